@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+# Places the elements described by a file of newline-delimited JSON, using
+# every core, and writes one JSON line per element to the output file in
+# input order:
+#
+#     python batch.py [--processes N] [--resume] input.ndjson output.ndjson
+#
+# Input and output lines have the same format as /ray/placements: each input
+# line is an object using the parameter names of PlotPage (without the
+# item{n}_ prefix), and blank lines are skipped.
+#
+# The output file is the checkpoint. Rerunning with --resume after an
+# interruption keeps the complete lines already written, discards any
+# partial last line and places only the remaining elements.
+
+from argparse import ArgumentParser
+from itertools import islice
+from multiprocessing import cpu_count, Pool
+from os import path
+from signal import signal, SIGINT, SIG_IGN
+from sys import exit, stderr
+from time import time
+
+from ray import place_line, PLACEMENT_CONTAINER_SIZE
+
+# Leaves interrupting to the parent process, which stops the pool.
+def ignore_interrupts():
+    signal(SIGINT, SIG_IGN)
+
+# Places one (line number, line) item, as /ray/placements does.
+def place(item):
+    (index, line) = item
+    return place_line(index, line, PLACEMENT_CONTAINER_SIZE)
+
+# Truncates output_path after its last complete line, returning the number
+# of complete lines.
+def completed_placements(output_path):
+    if not path.exists(output_path):
+        return 0
+    count = 0
+    end = 0
+    with open(output_path, 'rb+') as output:
+        for line in output:
+            if not line.endswith('\n'):
+                break
+            count += 1
+            end += len(line)
+        output.truncate(end)
+    return count
+
+# Yields (line number, line) for the non-blank lines after the first skip.
+def specifications(lines, skip):
+    for index, line in enumerate(lines, 1):
+        if line.strip() == '':
+            continue
+        if skip > 0:
+            skip -= 1
+            continue
+        yield index, line
+
+# Yields the results of place for each item, in order. Pool.imap reads its
+# input as fast as it can, so the items are sent in slices of slice_size to
+# bound the number held in memory.
+def placements(pool, items, chunk_size, slice_size):
+    while True:
+        items_slice = list(islice(items, slice_size))
+        if not items_slice:
+            return
+        for result in pool.imap(place, items_slice, chunk_size):
+            yield result
+
+class Progress(object):
+    def __init__(self, interval):
+        self.interval = interval
+        self.start = time()
+        self.reported = self.start
+        self.placements = 0
+        self.errors = 0
+
+    def add(self, error):
+        self.placements += 1
+        if error:
+            self.errors += 1
+        now = time()
+        if self.interval > 0 and now - self.reported >= self.interval:
+            self.reported = now
+            self.report(now)
+
+    def report(self, now):
+        seconds = now - self.start
+        stderr.write('{} placements ({} errors) in {:.1f}s, {:.1f} per second\n'.format(
+            self.placements, self.errors, seconds, self.placements / seconds if seconds > 0 else 0))
+
+def main():
+    parser = ArgumentParser(description='Place the elements described by a newline-delimited JSON file across a process pool.')
+    parser.add_argument('input', help='newline-delimited JSON file with one element per line')
+    parser.add_argument('output', help='file to write one JSON line per element to, in input order')
+    parser.add_argument('--processes', type=int, default=cpu_count(), help='worker processes (default: the number of cores)')
+    parser.add_argument('--chunk-size', type=int, default=256, help='elements sent to a worker at a time')
+    parser.add_argument('--resume', action='store_true', help='keep the placements already in the output file and continue after them')
+    parser.add_argument('--report', type=float, default=10, help='seconds between progress reports on stderr, or 0 for none')
+    arguments = parser.parse_args()
+
+    skip = completed_placements(arguments.output) if arguments.resume else 0
+    if skip:
+        stderr.write('Resuming after {} placements\n'.format(skip))
+
+    processes = max(1, arguments.processes)
+    chunk_size = max(1, arguments.chunk_size)
+    progress = Progress(arguments.report)
+    pool = Pool(processes, ignore_interrupts)
+    try:
+        with open(arguments.input, 'rb') as lines, open(arguments.output, 'ab' if skip else 'wb') as output:
+            # Enough chunks per slice to keep the workers busy while the
+            # last chunks of each slice finish.
+            for result, error in placements(pool, specifications(lines, skip), chunk_size, 64 * processes * chunk_size):
+                output.write(result)
+                progress.add(error)
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        progress.report(time())
+        stderr.write('Interrupted; rerun with --resume to continue\n')
+        exit(1)
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    progress.report(time())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+
+# Benchmarks for the hot paths of the application, runnable locally without
+# App Engine:
+#
+#     python benchmark.py [--repeat N] [--output results.json] [pattern ...]
+#
+# Each benchmark runs in a separate process so that its peak memory can be
+# reported alongside its throughput. Inputs are generated from a fixed seed,
+# so results from different revisions are comparable.
+
+from argparse import ArgumentParser, SUPPRESS
+from collections import OrderedDict
+from datetime import datetime
+from fnmatch import fnmatch
+from json import dump, dumps, loads
+from platform import platform, python_version
+from random import Random
+from resource import getrusage, RUSAGE_SELF
+from subprocess import check_output
+from sys import executable
+from time import time
+from urllib import urlencode
+
+SEED = 1
+
+# Grammars of the kind checked for the offset shorthand, in increasing order
+# of the number of expansions (4, 5, 22, 64 and 384).
+GRAMMARS = [
+    '<offset-path> || <offset-distance>',
+    '<offset-path> [ <offset-distance> || <offset-rotate> ]?',
+    '[ <offset-position>? [ <offset-path> [ <offset-distance> || <offset-rotate> ]? ]? ]! [ / <offset-anchor> ]?',
+    '<offset-path> || <offset-distance> || <offset-rotate> || <offset-position>',
+    '[ <offset-path> || <angle> ] && [ <size> || <url> ] && [ <geometry-box> || <basic-shape> ]',
+]
+
+BENCHMARKS = OrderedDict()
+
+# Registers a function returning (operations, run), where run() performs
+# that many operations and is timed.
+def benchmark(name):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def random_element(random, ray_size, contain):
+    import ray
+    size = ray.Size(random.uniform(0, 200), random.uniform(0, 200))
+    arguments = {
+        'id': 'box',
+        'size': size,
+        'background_color': '',
+        'offset_path': ray.RayPath(random.uniform(-360, 360), ray_size, contain),
+        'offset_distance': random.uniform(0, 100),
+        'offset_rotation': ray.OffsetRotation(random.random() < 0.5, random.uniform(-180, 180)),
+        'offset_position': ray.Point(random.uniform(0, 500), random.uniform(0, 500)),
+        'offset_anchor': ray.Point(random.uniform(0, size.width), random.uniform(0, size.height)),
+        'container_size': ray.Size(500, 500),
+    }
+    return lambda: ray.Element(**arguments)
+
+def element_benchmark(ray_size, contain):
+    def setup(random):
+        constructors = [random_element(random, ray_size, contain) for i in range(2000)]
+        def run():
+            for constructor in constructors:
+                # Derived values may be computed when first read.
+                element = constructor()
+                (element.v, element.path_length, element.translation)
+        return len(constructors), run
+    return setup
+
+for ray_size in ['closest-side', 'closest-corner', 'farthest-side', 'farthest-corner', 'sides']:
+    benchmark('element/{}'.format(ray_size))(element_benchmark(ray_size, False))
+    benchmark('element/{}/contain'.format(ray_size))(element_benchmark(ray_size, True))
+
+
+@benchmark('area_inside_unit_circle')
+def area_benchmark(random):
+    from ray import area_inside_unit_circle, Point
+    triangles = [[Point(random.uniform(-2, 2), random.uniform(-2, 2)) for vertex in range(3)] for i in range(5000)]
+    def run():
+        for p1, p2, p3 in triangles:
+            area_inside_unit_circle(p1, p2, p3)
+    return len(triangles), run
+
+
+@benchmark('locate_on_path')
+def locate_on_path_benchmark(random):
+    from ray import locate_on_path
+    path = 'M 10 80 C 40 10, 65 10, 95 80 S 150 150, 180 80 Q 200 0 250 50 A 40 20 30 1 1 300 100 Z'
+    distances = [random.uniform(0, 100) for i in range(5000)]
+    def run():
+        for distance in distances:
+            locate_on_path(path, distance)
+    return len(distances), run
+
+
+def ambiguity_benchmark(engine, grammar):
+    def setup(random):
+        import shorthand
+        root = shorthand.parse(shorthand.tokenise(grammar))
+        def run():
+            for i in range(10):
+                # Expansions are memoized across searches.
+                shorthand.EXPANSION_CACHE.clear()
+                shorthand.SEARCH_ENGINES[engine](root).search()
+        return 10, run
+    return setup
+
+for engine in ['concrete', 'symbolic']:
+    for index, grammar in enumerate(GRAMMARS, 1):
+        benchmark('ambiguity/{}/{}'.format(engine, index))(ambiguity_benchmark(engine, grammar))
+
+
+def plot_benchmark(count, handler='/ray/plot', options={}, requests=100, operations_per_request=1):
+    def setup(random):
+        from ray import app
+        from webapp2 import Request
+        parameters = dict(options)
+        for index in range(1, count + 1):
+            item = 'item{}_'.format(index)
+            parameters.update({
+                item + 'display': 'block',
+                item + 'width': random.uniform(5, 40),
+                item + 'height': random.uniform(5, 40),
+                item + 'position_x': random.uniform(0, 100),
+                item + 'position_y': random.uniform(0, 100),
+                item + 'direction': random.uniform(-360, 360),
+                item + 'distance': random.uniform(0, 100),
+                item + 'contain': random.choice(['contain', 'unbounded']),
+                item + 'rotation_auto': random.choice(['auto', '']),
+            })
+        url = handler + '?' + urlencode(sorted(parameters.items()))
+        def run():
+            for i in range(requests):
+                Request.blank(url).get_response(app).body
+        return requests * operations_per_request, run
+    return setup
+
+for count in range(1, 7):
+    benchmark('plot/{}'.format(count))(plot_benchmark(count))
+
+# Counts one operation per frame, for comparison with plot/6.
+benchmark('sweep/200')(plot_benchmark(6, '/ray/sweep', { 'sweep_frames': 200 }, 10, 200))
+
+
+# Runs one benchmark in this process, returning the best of repeat timings.
+def measure(name, repeat):
+    operations, run = BENCHMARKS[name](Random(SEED))
+    run() # warm up caches and imports
+    timings = []
+    for i in range(repeat):
+        start = time()
+        run()
+        timings.append(time() - start)
+    best = min(timings)
+    return {
+        'name': name,
+        'operations': operations,
+        'seconds': best,
+        'operations_per_second': operations / best if best > 0 else None,
+        'peak_memory_kb': getrusage(RUSAGE_SELF).ru_maxrss,
+    }
+
+def main():
+    parser = ArgumentParser(description='Benchmark ray geometry, shorthand search and plot rendering.')
+    parser.add_argument('patterns', nargs='*', default=['*'], help='shell-style patterns selecting benchmarks, e.g. "element/*"')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per benchmark; the best is reported')
+    parser.add_argument('--output', help='file to write JSON results to')
+    parser.add_argument('--list', action='store_true', help='list the benchmarks and exit')
+    parser.add_argument('--child', help=SUPPRESS)
+    arguments = parser.parse_args()
+
+    if arguments.child:
+        print dumps(measure(arguments.child, arguments.repeat))
+        return
+
+    names = [name for name in BENCHMARKS if any(fnmatch(name, pattern) for pattern in arguments.patterns)]
+    if arguments.list:
+        print '\n'.join(names)
+        return
+
+    results = []
+    for name in names:
+        result = loads(check_output([executable, __file__, '--child', name, '--repeat', str(arguments.repeat)]))
+        print '{:<36} {:>12.1f} ops/s {:>10} KB'.format(name, result['operations_per_second'] or 0, result['peak_memory_kb'])
+        results.append(result)
+
+    if arguments.output:
+        with open(arguments.output, 'w') as output:
+            dump({
+                'date': datetime.utcnow().isoformat(),
+                'python': python_version(),
+                'platform': platform(),
+                'seed': SEED,
+                'repeat': arguments.repeat,
+                'results': results,
+            }, output, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
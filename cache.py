@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+from collections import OrderedDict
+from hashlib import sha1
+from threading import Lock
+
+# A dictionary holding entries of total weight at most capacity, discarding
+# the least recently used entries when full. Each entry weighs
+# weight(value), or 1 if weight is None, so by default capacity is a number
+# of entries. A value weighing more than capacity is not stored. Safe to
+# share between request threads.
+class LRUCache(object):
+  def __init__(self, capacity, weight=None):
+    self.capacity = capacity
+    self.weight = weight
+    self.entries = OrderedDict()
+    self.weights = {}
+    self.total_weight = 0
+    self.lock = Lock()
+    self.hits = 0
+    self.misses = 0
+
+  def __len__(self):
+    return len(self.entries)
+
+  def __contains__(self, key):
+    return key in self.entries
+
+  def get(self, key, default=None):
+    with self.lock:
+      try:
+        value = self.entries.pop(key)
+      except KeyError:
+        self.misses += 1
+        return default
+      self.entries[key] = value
+      self.hits += 1
+      return value
+
+  def __setitem__(self, key, value):
+    weight = 1 if self.weight is None else self.weight(value)
+    with self.lock:
+      if key in self.entries:
+        del self.entries[key]
+        self.total_weight -= self.weights.pop(key)
+      if weight > self.capacity:
+        return
+      self.entries[key] = value
+      self.weights[key] = weight
+      self.total_weight += weight
+      while self.total_weight > self.capacity:
+        oldest, _ = self.entries.popitem(last=False)
+        self.total_weight -= self.weights.pop(oldest)
+
+  def clear(self):
+    with self.lock:
+      self.entries.clear()
+      self.weights.clear()
+      self.total_weight = 0
+
+# An LRUCache in front of a second tier shared between instances, such as
+# memcache, providing get(key) and set(key, value) for string keys. Keys
+# may be any hashable value with a stable repr. Values the second tier
+# rejects as too large are only held in the first tier.
+class TieredCache(object):
+  def __init__(self, capacity, second_tier=None, namespace='', weight=None):
+    self.first_tier = LRUCache(capacity, weight)
+    self.second_tier = second_tier
+    self.namespace = namespace
+    self.hits = 0
+    self.second_tier_hits = 0
+    self.misses = 0
+
+  def shared_key(self, key):
+    return self.namespace + sha1(repr(key)).hexdigest()
+
+  def get(self, key, default=None):
+    value = self.first_tier.get(key)
+    if value is not None:
+      self.hits += 1
+      return value
+
+    if self.second_tier is not None:
+      value = self.second_tier.get(self.shared_key(key))
+      if value is not None:
+        self.second_tier_hits += 1
+        self.first_tier[key] = value
+        return value
+
+    self.misses += 1
+    return default
+
+  def __setitem__(self, key, value):
+    self.first_tier[key] = value
+    if self.second_tier is not None:
+      try:
+        self.second_tier.set(self.shared_key(key), value)
+      except ValueError:
+        # Too large for the second tier, e.g. over memcache's 1MB limit.
+        pass
+
+  def clear(self):
+    self.first_tier.clear()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+from collections import defaultdict
+from json import dumps
+from os import environ
+from threading import local, Lock
+from time import time
+from webapp2 import RequestHandler, WSGIApplication
+
+# Timers are only active when the INSTRUMENTATION environment variable is
+# set, e.g. under env_variables in app.yaml. Otherwise timed() returns the
+# function it decorates, instrument() returns the application it wraps and
+# timer() is a context manager that does nothing.
+ENABLED = environ.get('INSTRUMENTATION', '') not in ('', '0', 'false')
+
+# Calls and seconds for each timer, per request and since the instance started.
+class Timings(object):
+  def __init__(self):
+    self.calls = defaultdict(int)
+    self.seconds = defaultdict(float)
+
+  def add(self, name, seconds):
+    self.calls[name] += 1
+    self.seconds[name] += seconds
+
+  def to_dict(self):
+    return dict((name, { 'calls': self.calls[name], 'seconds': self.seconds[name] }) for name in self.calls)
+
+INSTANCE_TIMINGS = Timings()
+INSTANCE_TIMINGS_LOCK = Lock()
+REQUEST = local()
+
+def request_timings():
+  try:
+    return REQUEST.timings
+  except AttributeError:
+    REQUEST.timings = Timings()
+    REQUEST.active = set()
+    return REQUEST.timings
+
+class NullTimer(object):
+  def __enter__(self):
+    pass
+  def __exit__(self, type, value, traceback):
+    pass
+
+NULL_TIMER = NullTimer()
+
+# Times the enclosed block under name. Recursive or nested uses of the same
+# name are only timed once, by the outermost.
+class Timer(object):
+  def __init__(self, name):
+    self.name = name
+
+  def __enter__(self):
+    request_timings()
+    if self.name in REQUEST.active:
+      self.start = None
+    else:
+      REQUEST.active.add(self.name)
+      self.start = time()
+
+  def __exit__(self, type, value, traceback):
+    if self.start is None:
+      return
+    seconds = time() - self.start
+    REQUEST.active.discard(self.name)
+    REQUEST.timings.add(self.name, seconds)
+    with INSTANCE_TIMINGS_LOCK:
+      INSTANCE_TIMINGS.add(self.name, seconds)
+
+def timer(name):
+  if not ENABLED:
+    return NULL_TIMER
+  return Timer(name)
+
+def timed(name):
+  def decorate(function):
+    if not ENABLED:
+      return function
+    def wrapper(*args, **kwargs):
+      with Timer(name):
+        return function(*args, **kwargs)
+    wrapper.__name__ = function.__name__
+    wrapper.__doc__ = function.__doc__
+    return wrapper
+  return decorate
+
+# Formats timings as a Server-Timing header value, with durations in
+# milliseconds and the number of calls as the description.
+def server_timing(timings):
+  def describe(name):
+    calls = timings.calls[name]
+    return '{};desc="{} call{}";dur={:.3f}'.format(name, calls, '' if calls == 1 else 's', timings.seconds[name] * 1000)
+  return ', '.join(describe(name) for name in sorted(timings.calls))
+
+# Wraps a WSGI application so that each response reports the time spent in
+# each timer while handling its request.
+def instrument(application):
+  if not ENABLED:
+    return application
+
+  def instrumented(environ, start_response):
+    REQUEST.timings = Timings()
+    REQUEST.active = set()
+
+    def start_instrumented_response(status, headers, exc_info=None):
+      if REQUEST.timings.calls:
+        headers = headers + [('Server-Timing', server_timing(REQUEST.timings))]
+      return start_response(status, headers, exc_info)
+
+    return application(environ, start_instrumented_response)
+  return instrumented
+
+
+# Responds with JSON giving, for each timer, the calls and seconds spent
+# since this instance started.
+class StatsPage(RequestHandler):
+  def get(self):
+    with INSTANCE_TIMINGS_LOCK:
+      stats = INSTANCE_TIMINGS.to_dict()
+    self.response.headers['Content-Type'] = 'application/json'
+    self.response.write(dumps({ 'enabled': ENABLED, 'timers': stats }, sort_keys=True))
+
+
+app = WSGIApplication([
+  ('/ray/stats/', StatsPage),
+])
@@ -1,16 +1,25 @@
 #!/usr/bin/env python
 
+from cStringIO import StringIO
+from email.utils import formatdate, mktime_tz, parsedate_tz
+from google.appengine.api import memcache
 from google.appengine.ext import ndb
-from jinja2 import Environment, FileSystemLoader
-from json import dumps
+from gzip import GzipFile
+from hashlib import sha1
+from instrumentation import instrument, timed, timer
+from json import dumps, loads
 from os import path
-from re import compile
-from sets import Set
+from re import compile, DOTALL, findall, search
+from rendering import PLAIN_ENVIRONMENT
+from struct import pack, unpack
+from time import time
 from webapp2 import RequestHandler, WSGIApplication
 
 
-JINJA_ENVIRONMENT = Environment(
-    loader=FileSystemLoader(path.dirname(__file__)))
+JINJA_ENVIRONMENT = PLAIN_ENVIRONMENT
+
+
+BROWSERS = ['Chrome', 'Edge', 'Firefox', 'Opera', 'Safari']
 
 
 class Measurement(ndb.Model):
@@ -18,10 +27,176 @@ class Measurement(ndb.Model):
   serialization = ndb.StringProperty()
 
 
+# Packs measurements, given as a dict from result name (result_{context}_{value})
+# to serialization, as the number of distinct serializations, each
+# serialization in UTF-8 preceded by its length, then a (context, value,
+# serialization index) triple per measurement. Integers are little-endian.
+def pack_measurements(results):
+  strings = []
+  string_indices = {}
+  cells = []
+  for name, serialization in sorted(results.iteritems()):
+    (_, context, value) = name.split('_')
+    if serialization not in string_indices:
+      string_indices[serialization] = len(strings)
+      strings.append(serialization.encode('utf-8'))
+    cells.extend([int(context), int(value), string_indices[serialization]])
+  table = ''.join(pack('<I', len(string)) + string for string in strings)
+  return pack('<I', len(strings)) + table + pack('<{}I'.format(len(cells)), *cells)
+
+def unpack_measurements(packed):
+  (count,) = unpack('<I', packed[:4])
+  offset = 4
+  strings = []
+  for index in range(count):
+    (length,) = unpack('<I', packed[offset:offset + 4])
+    strings.append(packed[offset + 4:offset + 4 + length].decode('utf-8'))
+    offset += 4 + length
+  body = packed[offset:]
+  cells = unpack('<{}I'.format(len(body) // 4), body)
+  return dict(('result_{}_{}'.format(cells[index], cells[index + 1]), strings[cells[index + 2]]) for index in range(0, len(cells), 3))
+
+
+# Submissions recorded before packed_measurements was introduced hold
+# Measurement structures instead, until packed by MigratePage.
 class Submission(ndb.Model):
   browser = ndb.StringProperty(indexed=True, required=True)
   version = ndb.IntegerProperty()
   measurements = ndb.StructuredProperty(Measurement, repeated=True)
+  packed_measurements = ndb.BlobProperty(compressed=True)
+
+  # Returns a dict from result name to serialization.
+  # Packed measurements are only decoded when asked for.
+  def results(self):
+    if self.packed_measurements is not None:
+      return unpack_measurements(self.packed_measurements)
+    return dict((measurement.context, measurement.serialization) for measurement in self.measurements)
+
+
+# Identifies the Submission with the highest version for a browser.
+# Keyed by browser name.
+class LatestSubmission(ndb.Model):
+  version = ndb.IntegerProperty(indexed=False)
+  submission = ndb.KeyProperty(kind=Submission, indexed=False)
+
+
+@ndb.transactional
+def update_latest_submission(browser, version, submission_key):
+  latest = LatestSubmission.get_by_id(browser)
+  if latest is None or latest.version <= version:
+    LatestSubmission(id=browser, version=version, submission=submission_key).put()
+
+@timed('datastore')
+def record_latest_submission(browser, version, submission_key):
+  if LatestSubmission.get_by_id(browser) is None:
+    # The first pointer for a browser must account for the submissions
+    # recorded before pointers were introduced, which can only be found by a
+    # query, and so outside the transaction.
+    newest = Submission.query(Submission.browser == browser).order(-Submission.version).get()
+    if newest is not None and newest.version > version:
+      (version, submission_key) = (newest.version, newest.key)
+  update_latest_submission(browser, version, submission_key)
+
+
+# Compares the latest results of each browser, keeping the most recent
+# changes of each result between versions. Updated as submissions are
+# recorded, so that comparisons never rescan submissions.
+class Comparison(ndb.Model):
+  # browser -> { 'version': version, 'results': { result name: serialization } }
+  latest = ndb.JsonProperty(indexed=False)
+  # result name -> [{ 'browser', 'from_version', 'to_version', 'from', 'to' }]
+  changes = ndb.JsonProperty(indexed=False)
+
+COMPARISON_ID = 'latest'
+COMPARISON_HISTORY = 20
+
+# Updates the latest results and changes of a Comparison with one submission.
+def compare_submission(latest, changes, browser, version, results):
+  previous = latest.get(browser)
+  if previous is not None:
+    if previous['version'] > version:
+      return
+    for name, serialization in results.iteritems():
+      before = previous['results'].get(name)
+      if before is not None and before != serialization:
+        history = changes.setdefault(name, [])
+        history.append({
+          'browser': browser,
+          'from_version': previous['version'],
+          'to_version': version,
+          'from': before,
+          'to': serialization
+        })
+        del history[:-COMPARISON_HISTORY]
+
+  latest[browser] = { 'version': version, 'results': results }
+
+@ndb.transactional
+def update_comparison(submissions, initial_latest):
+  comparison = Comparison.get_by_id(COMPARISON_ID) or Comparison(id=COMPARISON_ID, latest=initial_latest)
+  latest = comparison.latest or {}
+  changes = comparison.changes or {}
+  for (browser, version, results) in submissions:
+    compare_submission(latest, changes, browser, version, results)
+  comparison.latest = latest
+  comparison.changes = changes
+  comparison.put()
+
+# Records (browser, version, results) triples, in order, in one transaction.
+# The first comparison starts from the latest submission of each browser,
+# found outside the transaction as it needs queries, so that browsers which
+# have not submitted since are still compared.
+@timed('datastore')
+def record_comparisons(submissions):
+  initial_latest = None
+  if Comparison.get_by_id(COMPARISON_ID) is None:
+    initial_latest = latest_results()
+  update_comparison(submissions, initial_latest)
+
+def record_comparison(browser, version, results):
+  record_comparisons([(browser, version, results)])
+
+
+# \Z rather than $, which would also match before a trailing newline.
+KEY_REGEX = compile(r"^result_(\d+)_(\d+)\Z")
+VALUE_REGEX = compile(r"^([ %\(\)\+\-\.\da-z]+)\Z")
+# Context and value indices are packed as unsigned 32-bit integers.
+RESULT_INDEX_LIMIT = 1 << 32
+
+# Validates the fields of one submission, a mapping from result names to
+# serializations which may contain other fields. Returns (submission, error),
+# with an empty error if the submission is valid.
+def create_submission(browser, version, fields):
+  error = ''
+  if browser not in BROWSERS:
+    error = 'Unknown browser'
+
+  try:
+    version = int(version)
+  except:
+    version = 0
+    error = 'Unknown version'
+
+  results = {}
+  for key, value in fields.iteritems():
+    match = KEY_REGEX.match(key)
+    if match:
+      if any(int(index) >= RESULT_INDEX_LIMIT for index in match.groups()):
+        error = 'Bad <position> result'
+      elif isinstance(value, basestring) and VALUE_REGEX.match(value):
+        results[key] = value
+      else:
+        error = 'Bad <position> value'
+
+  if error != '':
+    return (None, error)
+
+  submission = Submission(
+    browser = browser,
+    version = version,
+    packed_measurements = pack_measurements(results)
+  )
+  return (submission, error)
 
 
 class RecordPage(RequestHandler):
@@ -33,48 +208,36 @@ class RecordPage(RequestHandler):
       self.response.write(record_request_template.render(record_request_template_values))
 
     def post(self):
-      error = ''
       browser = self.request.get('browser', default_value='unknown')
-      if browser not in ['Chrome', 'Edge', 'Firefox', 'Opera', 'Safari']:
-        error = 'Unknown browser'
-
-      try:
-        version = int(self.request.get('version', default_value='0'))
-      except:
-        version = 0
-        error = 'Unknown version'
-
-      keyRegex = compile(r"^result_(\d+)_(\d+)$")
-      valueRegex = compile(r"^([ %\(\)\+\-\.\da-z]+)$")
-
-      measurements = []
-      for key, value in self.request.POST.iteritems():
-        match = keyRegex.match(key)
-        if match:
-          if valueRegex.match(value):
-            measurements.append(Measurement(
-              context = key,
-              serialization = value
-            ))
-          else:
-            error = 'Bad <position> value'
+      (submission, error) = create_submission(browser, self.request.get('version', default_value='0'), self.request.POST)
 
       if error == '':
-        submission = Submission(
-          browser = browser,
-          version = version,
-          measurements = measurements
-        )
+        version = submission.version
         try:
-          submission_key = submission.put()
+          with timer('datastore'):
+            submission_key = submission.put()
         except:
           error = 'Failed to store measurement'
 
       if error == '':
+        # The submission is stored whatever happens here, so a failure is
+        # reported alongside its key rather than inviting it to be submitted
+        # again.
+        try:
+          record_latest_submission(browser, version, submission_key)
+        except:
+          error = 'Failed to record latest submission'
+        try:
+          record_comparison(browser, version, submission.results())
+        except:
+          error = 'Failed to record comparison'
+        invalidate_report()
+
         record_acknowledgement_template_values = {
           'browser': browser,
           'version': version,
-          'submission_key': submission_key
+          'submission_key': submission_key,
+          'error': error
         }
         record_acknowledgement_template = JINJA_ENVIRONMENT.get_template('templates/record_acknowledgement.html')
         self.response.write(record_acknowledgement_template.render(record_acknowledgement_template_values))
@@ -85,31 +248,274 @@ class RecordPage(RequestHandler):
         record_request_template = JINJA_ENVIRONMENT.get_template('templates/record_request.html')
         self.response.write(record_request_template.render(record_request_template_values))
 
+# Returns the submission with the highest version for each browser, in
+# browser order. Browsers with no LatestSubmission, whose submissions were
+# all recorded before it was introduced, are queried instead.
+@timed('datastore')
+def latest_submissions():
+  pointers = ndb.get_multi([ndb.Key(LatestSubmission, browser) for browser in BROWSERS])
+  futures = []
+  for browser, pointer in zip(BROWSERS, pointers):
+    if pointer is None:
+      futures.append(Submission.query(Submission.browser == browser).order(-Submission.version).get_async())
+    else:
+      futures.append(pointer.submission.get_async())
+  return [submission for submission in [future.get_result() for future in futures] if submission is not None]
+
+# The version and results of the latest submission of each browser, in the
+# form of Comparison.latest.
+def latest_results():
+  return dict((submission.browser, { 'version': submission.version, 'results': submission.results() }) for submission in latest_submissions())
+
+# The contexts and values measured by position.js, in order.
+def read_position_script():
+  with open(path.join(path.dirname(__file__), 'resources/position.js')) as script:
+    source = script.read()
+
+  def strings(name):
+    body = search(r"const " + name + r" = \[(.*?)\];", source, DOTALL).group(1)
+    return findall(r"'([^']*)'", body)
+
+  return (strings('contexts'), strings('values'))
+
+(CONTEXTS, VALUES) = read_position_script()
+
+def result_name(context_index, value_index):
+  return 'result_{}_{}'.format(context_index, value_index)
+
+# One markdown table per value, with a row per context and a column per
+# submission.
+def markdown_report(submissions):
+  lines = []
+  for value_index, value in enumerate(VALUES):
+    lines.append('| ' + value + ' | ' + ''.join('{} {} | '.format(submission['browser'], submission['version']) for submission in submissions))
+    lines.append('| --- | ' + '--- | ' * len(submissions))
+    for context_index, context in enumerate(CONTEXTS):
+      name = result_name(context_index, value_index)
+      lines.append('| ' + context + ' | ' + ''.join(submission['results'].get(name, 'undefined') + ' | ' for submission in submissions))
+    lines.append('')
+  return '\n'.join(lines) + '\n'
+
+def gzip_compress(body):
+  buffer = StringIO()
+  with GzipFile(fileobj=buffer, mode='wb', mtime=0) as compressed:
+    compressed.write(body)
+  return buffer.getvalue()
+
+# The search results in each format, encoded and compressed ahead of time.
+class Report(object):
+  CONTENT_TYPES = {
+    'html': 'text/html; charset=utf-8',
+    'json': 'application/json',
+    'markdown': 'text/markdown; charset=utf-8',
+  }
+
+  def __init__(self, submissions):
+    markdown = markdown_report(submissions)
+    search_request_template = JINJA_ENVIRONMENT.get_template('templates/search_request.html')
+    with timer('render'):
+      html = search_request_template.render({ 'report': markdown })
+    bodies = {
+      'html': html.encode('utf-8'),
+      'json': dumps(submissions),
+      'markdown': markdown.encode('utf-8'),
+    }
+    self.bodies = dict((format, (body, gzip_compress(body))) for format, body in bodies.iteritems())
+    self.etag = sha1(bodies['json']).hexdigest()
+    self.last_modified = int(time())
+
+# Reports are cached under a generation number, which recording a
+# submission increments. A report built from data read before a
+# submission was recorded is therefore never served after it.
+REPORT_GENERATION_KEY = 'position-report-generation'
+
+def report_generation():
+  generation = memcache.get(REPORT_GENERATION_KEY)
+  if generation is None:
+    memcache.add(REPORT_GENERATION_KEY, int(time()))
+    generation = memcache.get(REPORT_GENERATION_KEY)
+  return generation
+
+def invalidate_report():
+  memcache.incr(REPORT_GENERATION_KEY, initial_value=int(time()))
+
+def latest_report():
+  key = 'position-report:{}'.format(report_generation())
+  report = memcache.get(key)
+  if report is None:
+    report = Report([{
+      'browser': submission.browser,
+      'version': submission.version,
+      'results': submission.results()
+    } for submission in latest_submissions()])
+    memcache.set(key, report)
+  return report
+
+# Serves the report in the format named by the format parameter: html,
+# json or markdown.
 class SearchPage(RequestHandler):
     def get(self):
-      browsers = Set()
-      submissions = {}
-      query = Submission.query().order(Submission.version)
-      for submission in query.iter():
-        def measurement_to_dict(measurement):
-          return { 'context': measurement.context, 'serialization': measurement.serialization }
-
-        browsers.add(submission.browser)
-        submissions[submission.browser] = {
-          'browser': submission.browser,
-          'version': submission.version,
-          'measurements': map(measurement_to_dict, submission.measurements)
-        }
+      format = self.request.get('format', 'html')
+      if format not in Report.CONTENT_TYPES:
+        self.abort(404)
 
-      submissions = map(lambda browser: submissions[browser], sorted(browsers))
-      search_request_template_values = {
-        'submissions': dumps(submissions)
-      }
-      search_request_template = JINJA_ENVIRONMENT.get_template('templates/search_request.html')
-      self.response.write(search_request_template.render(search_request_template_values))
+      report = latest_report()
+      gzipped = 'gzip' in self.request.headers.get('Accept-Encoding', '')
+      etag = '"{}-{}{}"'.format(report.etag, format, '-gzip' if gzipped else '')
+
+      self.response.headers['Vary'] = 'Accept-Encoding'
+      self.response.headers['ETag'] = etag
+      self.response.headers['Last-Modified'] = formatdate(report.last_modified, usegmt=True)
+
+      modified_since = parsedate_tz(self.request.headers.get('If-Modified-Since', ''))
+      if etag in self.request.headers.get('If-None-Match', '') or (
+          'If-None-Match' not in self.request.headers and modified_since is not None and mktime_tz(modified_since) >= report.last_modified):
+        self.response.set_status(304)
+        return
+
+      (body, compressed) = report.bodies[format]
+      self.response.headers['Content-Type'] = Report.CONTENT_TYPES[format]
+      if gzipped:
+        self.response.headers['Content-Encoding'] = 'gzip'
+        self.response.body = compressed
+      else:
+        self.response.body = body
+
+
+# Responds with JSON describing, for each context and value in position.js,
+# which browsers agree on the serialization and how it has changed between
+# versions.
+class ComparisonPage(RequestHandler):
+    def get(self):
+      with timer('datastore'):
+        comparison = Comparison.get_by_id(COMPARISON_ID)
+      if comparison is None:
+        # No submissions recorded since comparisons were introduced.
+        latest = latest_results()
+        changes = {}
+      else:
+        latest = comparison.latest
+        changes = comparison.changes
+
+      browsers = sorted(latest)
+      results = []
+      for context_index, context in enumerate(CONTEXTS):
+        for value_index, value in enumerate(VALUES):
+          name = result_name(context_index, value_index)
+          groups = {}
+          for browser in browsers:
+            serialization = latest[browser]['results'].get(name)
+            if serialization is not None:
+              groups.setdefault(serialization, []).append(browser)
+          results.append({
+            'name': name,
+            'context': context,
+            'value': value,
+            'groups': [{ 'serialization': serialization, 'browsers': groups[serialization] } for serialization in sorted(groups)],
+            'agreement': len(groups) <= 1,
+            'changes': changes.get(name, [])
+          })
+
+      self.response.headers['Content-Type'] = 'application/json'
+      self.response.write(dumps({
+        'browsers': dict((browser, latest[browser]['version']) for browser in browsers),
+        'results': results
+      }))
+
+
+# Records many submissions in one request. The body is a JSON list with
+# one object per submission, holding the same fields as RecordPage's form.
+# Responds with a JSON list giving, for each submission, its key if stored
+# and any error.
+class BulkRecordPage(RequestHandler):
+    def post(self):
+      self.response.headers['Content-Type'] = 'application/json'
+      try:
+        submissions_fields = loads(self.request.body)
+        if not isinstance(submissions_fields, list) or not all(isinstance(fields, dict) for fields in submissions_fields):
+          raise ValueError('Expected a list of objects')
+      except ValueError as err:
+        self.response.set_status(400)
+        self.response.write(dumps({ 'error': str(err) }))
+        return
+
+      statuses = []
+      submissions = []
+      for fields in submissions_fields:
+        (submission, error) = create_submission(fields.get('browser', 'unknown'), fields.get('version', '0'), fields)
+        statuses.append({ 'error': error })
+        if submission is not None:
+          submissions.append((statuses[-1], submission))
+
+      futures = ndb.put_multi_async([submission for (_, submission) in submissions])
+      stored = []
+      latest = {}
+      for (status, submission), future in zip(submissions, futures):
+        try:
+          with timer('datastore'):
+            submission_key = future.get_result()
+        except:
+          status['error'] = 'Failed to store measurement'
+          continue
+        status['submission_key'] = submission_key.urlsafe()
+        stored.append((status, submission))
+        if submission.browser not in latest or latest[submission.browser][0] <= submission.version:
+          latest[submission.browser] = (submission.version, submission_key)
+
+      # The submissions are stored whatever happens below, so failures are
+      # reported alongside their keys rather than failing the request, which
+      # would lead to them being submitted again.
+      for browser, (version, submission_key) in latest.iteritems():
+        try:
+          record_latest_submission(browser, version, submission_key)
+        except:
+          for (status, submission) in stored:
+            if submission.browser == browser:
+              status['error'] = 'Failed to record latest submission'
+      if stored:
+        # One transaction, as every submission updates the same Comparison.
+        stored.sort(key=lambda (status, submission): submission.version)
+        try:
+          record_comparisons([(submission.browser, submission.version, submission.results()) for (_, submission) in stored])
+        except:
+          for (status, _) in stored:
+            status['error'] = 'Failed to record comparison'
+      invalidate_report()
+
+      self.response.write(dumps(statuses))
+
+
+MIGRATION_BATCH_SIZE = 100
+
+# Packs the measurements of one batch of submissions per request. Post
+# again with the returned cursor until more is false.
+class MigratePage(RequestHandler):
+    def post(self):
+      cursor = None
+      if self.request.get('cursor'):
+        cursor = ndb.Cursor(urlsafe=self.request.get('cursor'))
+      (submissions, next_cursor, more) = Submission.query().fetch_page(MIGRATION_BATCH_SIZE, start_cursor=cursor)
+
+      migrated = []
+      for submission in submissions:
+        if submission.packed_measurements is None:
+          submission.packed_measurements = pack_measurements(submission.results())
+          submission.measurements = []
+          migrated.append(submission)
+      ndb.put_multi(migrated)
+
+      self.response.headers['Content-Type'] = 'application/json'
+      self.response.write(dumps({
+        'migrated': len(migrated),
+        'cursor': next_cursor.urlsafe() if more else None,
+        'more': more
+      }))
 
 
-app = WSGIApplication([
+app = instrument(WSGIApplication([
+    ('/ray/position/record/bulk', BulkRecordPage),
+    ('/ray/position/record/migrate', MigratePage),
     ('/ray/position/record/', RecordPage),
     ('/ray/position/search/', SearchPage),
-])
+    ('/ray/position/search/comparison', ComparisonPage),
+]))
@@ -1,149 +1,116 @@
 #!/usr/bin/env python
 
-from jinja2 import Environment, FileSystemLoader
-from math import atan2, cos, degrees, fabs, pi, radians, sin, sqrt
-from os import path
+from instrumentation import instrument, timed, timer
+from json import dumps, loads
+from math import atan2, cos, degrees, fabs, isinf, isnan, radians, sin, sqrt
+from rendering import AUTOESCAPE_ENVIRONMENT, DEVELOPMENT
+from svgpath import path_geometry
 from webapp2 import RequestHandler, WSGIApplication
 
 NUM_ITEMS = 6
 
-class Size:
+class Size(object):
+    __slots__ = ('width', 'height')
     def __init__(self, width, height):
         self.width = width
         self.height = height
     def __str__(self):
         return 'Size({}, {})'.format(self.width, self.height)
 
-class Point:
+class Point(object):
+    __slots__ = ('x', 'y', '_r')
     def __init__(self, x, y, r = None):
         self.x = x
         self.y = y
-        self.r = r
-        if self.r is None:
-            self.r = sqrt(x*x + y*y)
+        self._r = r
+    # The distance from the origin, computed when first needed.
+    @property
+    def r(self):
+        if self._r is None:
+            self._r = sqrt(self.x*self.x + self.y*self.y)
+        return self._r
+    @r.setter
+    def r(self, r):
+        self._r = r
     def __str__(self):
         return 'Point({}, {})'.format(self.x, self.y)
 
-def triangle_area(p1, p2, p3):
-    return fabs(p1.x * (p2.y - p3.y) + p2.x * (p3.y - p1.y) + p3.x * (p1.y - p2.y)) / 2
-
-def encloses_origin(p1, p2, p3):
-    def origin_right(begin, end):
-        return (end.y * (begin.x - end.x) - end.x * (begin.y - end.y)) < 0
-
-    d12 = origin_right(p1, p2)
-    d23 = origin_right(p2, p3)
-    d31 = origin_right(p3, p1)
-    return d12 == d23 and d23 == d31
-
-# Given two points on the unit circle, returns
-# the area of the circular segment between the
-# arc and the chord.
-def segment_area(p1, p2):
-    x = p1.x * p2.x + p1.y * p2.y
-    y = p1.x * p2.y - p1.y * p2.x
-    theta = fabs(atan2(y, x))
-    return (theta - sin(theta)) / 2
-
-# Identifies the points of intersection between
-# the open interval q1-q2 and the unit circle.
-def intersection_with_unit_circle(q1, q2):
-    if q1.r <= 1 and q2.r <= 1:
-        return []
-
-    if q2.r == 1:
-        [q1, q2] = [q2, q1]
-
-    if q1.r == 1:
-        # Interval: x = t xd + q1.x, y = t yd + q1.y, 0 <= t <= 1
-        xd = q2.x - q1.x
-        yd = q2.y - q1.y
-
-        # Circle: x**2 + y**2 = 1**2 = q1.x**2 + q1.y**2
-        # (t xd + q1.x)**2 + (t yd + q1.y)**2 - q1.x**2 - q1.y**2 = 0
-        # (xd**2 + yd**2) * t**2 + 2 * (xd * q1.x + yd * q1.y) * t = 0
-        a = xd**2 + yd**2
-        b = 2.0 * (xd * q1.x + yd * q1.y)
-        if a == 0:
-            return []
-        t = -b / a
-        if t <= 0 or t >= 1:
-            return []
-        return [Point(t * xd + q1.x, t * yd + q1.y, 1)]
-
-    # Interval: x = t xd + xs, y = t yd + ys, -1 <= t <= 1
-    xd = (q2.x - q1.x) / 2.0
-    xs = (q1.x + q2.x) / 2.0
-    yd = (q2.y - q1.y) / 2.0
-    ys = (q1.y + q2.y) / 2.0
-
-    # Circle: x**2 + y**2 = 1**2
-    # (t xd + xs)**2 + (t yd + ys)**2 - 1 = 0
-
-    a = xd**2 + yd**2
-    b = 2 * (xd * xs + yd * ys)
-    c = xs**2 + ys**2 - 1
-    discriminant = b**2 - 4 * a * c
-    if discriminant < 0 or a == 0:
-        solutions = []
-    elif discriminant == 0:
-        solutions = [-b / (2.0 * a)]
+# Twice the signed area of the intersection between the unit circle and
+# the triangle formed by the origin, begin and end. The edge from begin
+# to end is split where it crosses the circle: the part inside contributes
+# a triangle, the parts outside contribute circular sectors.
+def edge_area_inside_unit_circle(begin, end):
+    def sector(u, v):
+        return atan2(u.x * v.y - u.y * v.x, u.x * v.x + u.y * v.y)
+
+    xd = end.x - begin.x
+    yd = end.y - begin.y
+
+    # Circle: (begin.x + t xd)**2 + (begin.y + t yd)**2 = 1
+    a = xd * xd + yd * yd
+    b = begin.x * xd + begin.y * yd
+    c = begin.x * begin.x + begin.y * begin.y - 1
+    discriminant = b * b - a * c
+    if discriminant > 0 and a > 0:
+        t1 = max(0, min(1, (-b - sqrt(discriminant)) / a))
+        t2 = max(0, min(1, (-b + sqrt(discriminant)) / a))
     else:
-        solutions = [(-b + sqrt(discriminant)) / (2.0 * a), (-b - sqrt(discriminant)) / (2.0 * a)]
-
-    return [Point(t * xd + xs, t * yd + ys, 1) for t in solutions if fabs(t) < 1]
+        t1 = t2 = 0
+    q1 = Point(begin.x + t1 * xd, begin.y + t1 * yd)
+    q2 = Point(begin.x + t2 * xd, begin.y + t2 * yd)
+    return sector(begin, q1) + (q1.x * q2.y - q1.y * q2.x) + sector(q2, end)
 
 # determine the area of intersection between the triangle and the unit circle.
 def area_inside_unit_circle(p1, p2, p3):
-    external = 0
-    for [q1, q2, q3] in [[p1, p2, p3], [p2, p3, p1], [p3, p1, p2]]:
-        if q3.r > 1:
-            external += 1
-        intersections = intersection_with_unit_circle(q1, q2)
-        if len(intersections) == 0:
-            continue
+    return fabs(edge_area_inside_unit_circle(p1, p2) + edge_area_inside_unit_circle(p2, p3) + edge_area_inside_unit_circle(p3, p1)) / 2
 
-        points = [q1] + intersections + [q2]
-        area = 0
-        for index in range(1, len(points)):
-            area += area_inside_unit_circle(points[index - 1], points[index], q3)
-        return area
-
-    if external == 0:
-        return triangle_area(p1, p2, p3)
-    elif external == 1:
-        if p2.r < p1.r:
-            [p1, p2] = [p2, p1]
-        if p3.r < p2.r:
-            [p2, p3] = [p3, p2]
-        if p2.r < p1.r:
-            [p1, p2] = [p2, p1]
-        return segment_area(p1, p2)
-    elif external == 2:
-        return 0
-    elif encloses_origin(p1, p2, p3):
-        return pi
-    else:
-        return 0
+class NewtonResult:
+    def __init__(self, x, converged, iterations, evaluations):
+        self.x = x
+        self.converged = converged
+        self.iterations = iterations
+        self.evaluations = evaluations
+    def __str__(self):
+        return 'NewtonResult({}, {}, {}, {})'.format(self.x, self.converged, self.iterations, self.evaluations)
+
+NEWTON_EPSILON = 1e-6
 
 # Search for x such that the first derivative of
 # function becomes 0. Use x0 as the initial guess.
-def newton(function, x0):
-    EPSILON = 1e-6
+# The first and second derivatives are estimated by finite differences
+# unless derivative and second_derivative are given. The search has
+# converged when the first derivative is within tolerance of 0.
+def newton_search(function, x0, derivative=None, second_derivative=None, tolerance=NEWTON_EPSILON, max_iterations=10):
+    EPSILON = NEWTON_EPSILON
     x = x0
+    evaluations = 0
+
+    for iteration in range(max_iterations):
+        if derivative is None:
+            fp = function(x + EPSILON)
+            f = function(x)
+            fm = function(x - EPSILON)
+            evaluations += 3
+
+            fd = (fp - fm) / (2 * EPSILON)
+            fdd = (fp + fm - 2 * f) / (EPSILON**2)
+        elif second_derivative is None:
+            fd = derivative(x)
+            fdd = (derivative(x + EPSILON) - derivative(x - EPSILON)) / (2 * EPSILON)
+            evaluations += 3
+        else:
+            fd = derivative(x)
+            fdd = second_derivative(x)
+            evaluations += 2
 
-    for _ in range(10):
-        fp = function(x + EPSILON)
-        f = function(x)
-        fm = function(x - EPSILON)
-
-        fd = (fp - fm) / (2 * EPSILON)
-        fdd = (fp + fm - 2 * f) / (EPSILON**2)
-        if fabs(fd) < EPSILON or fabs(fdd) < EPSILON:
-            return x
+        if fabs(fd) < tolerance or fabs(fdd) < EPSILON:
+            return NewtonResult(x, fabs(fd) < tolerance, iteration, evaluations)
         x = x - fd / fdd
 
-    return x
+    return NewtonResult(x, False, max_iterations, evaluations)
+
+def newton(function, x0):
+    return newton_search(function, x0).x
 
 def translate(dx, dy):
     return lambda point: Point(point.x + dx, point.y + dy)
@@ -157,7 +124,8 @@ def rotate(angle):
     )
 
 
-class Interval:
+class Interval(object):
+    __slots__ = ('lower_bound', 'upper_bound')
     def __init__(self, lower_bound, upper_bound):
         self.lower_bound = lower_bound
         self.upper_bound = upper_bound
@@ -193,6 +161,74 @@ def distance_to_sides(distLeft, distTop, distRight, distBottom, angle):
         return distVertical / cs
     return distHorizontal / sn
 
+# The offset along a ray() path of length radius, as close as possible to
+# computed_offset, at which the rectangle with vertices (given in order
+# around its boundary) lies within the path. If no such offset exists,
+# the offset for the smallest path length that contains the rectangle.
+# Works on plain floats in the path's frame, where the path runs along
+# the x-axis.
+def contain_offset(vertices, angle, radius, computed_offset):
+    epsilon = 0.0001
+    c = cos(radians(90 - angle))
+    s = sin(radians(90 - angle))
+    xs = [c * v.x - s * v.y for v in vertices]
+    ys = [c * v.y + s * v.x for v in vertices]
+
+    # Determine the offset interval such that all vertices lie within the path.
+    # We require (offset + x)**2 + y**2 <= radius**2
+    lower_bound = upper_bound = None
+    for x, y in zip(xs, ys):
+        discriminant = radius * radius - y * y
+        if discriminant < 0:
+            break # no solution
+        root = sqrt(discriminant)
+        if lower_bound is None or -x - root > lower_bound:
+            lower_bound = -x - root
+        if upper_bound is None or -x + root < upper_bound:
+            upper_bound = -x + root
+    else:
+        if lower_bound <= upper_bound:
+            return max(lower_bound, min(upper_bound, computed_offset))
+
+    # The path length will need to be increased.
+    # We find the smallest path length such that an offset exists for all vertices to lie within the path.
+
+    # Start from the vertex furthest from the x-axis.
+    k = max(range(4), key=lambda k: fabs(ys[k]))
+    radius = fabs(ys[k])
+    offset = -xs[k]
+
+    # At the smallest path length, the vertices on the path are the ones
+    # furthest from its centre. For a rectangle these are the two ends of
+    # an edge (opposite corners are only furthest when all four are), so
+    # only the four edges need to be considered.
+    for k in range(4):
+        # Take i as the end further from the x-axis.
+        i, j = k, (k + 1) % 4
+        if fabs(ys[j]) > fabs(ys[i]) or (j == 0 and fabs(ys[j]) == fabs(ys[i])):
+            i, j = j, i
+        xi = xs[i]
+        yi = ys[i]
+        xj = xs[j]
+        yj = ys[j]
+        xd = xi - xj
+
+        if xd * xd + yj * yj <= yi * yi + epsilon:
+            # Any path that encloses vertices[i] would also enclose vertices[j].
+            continue
+
+        # If both lie on the path,
+        # (offset + xi)**2 + yi**2 = (offset + xj)**2 + yj**2 = (path length)**2
+        # 2 * xi * offset + xi**2 + yi**2 = 2 * xj * offset + xj**2 + yj**2
+        candidate_offset = (xj * xj + yj * yj - xi * xi - yi * yi) / 2 / xd
+        xi += candidate_offset
+        candidate_radius = sqrt(xi * xi + yi * yi)
+        if radius < candidate_radius:
+            radius = candidate_radius
+            offset = candidate_offset
+
+    return offset
+
 class RayPath:
     def __init__(self, angle, size, contain):
         if size not in [
@@ -226,6 +262,17 @@ class StringPath:
     def __str__(self):
         return 'StringPath({}, {}, {}, {}, {})'.format(self.path, self.x, self.y, self.dx, self.dy)
 
+# The StringPath for the point offset_distance percent along path and the
+# direction of the path there, as ray.html finds with getPointAtLength.
+def locate_on_path(path, offset_distance):
+    geometry = path_geometry(path)
+    if geometry.closed:
+        offset_distance = offset_distance % 100
+    else:
+        offset_distance = max(0, min(100, offset_distance))
+    (x, y, dx, dy) = geometry.point_at_length(geometry.length * offset_distance / 100.)
+    return StringPath(path, x, y, dx, dy)
+
 
 class OffsetRotation:
     def __init__(self, auto = True, angle = 0):
@@ -235,48 +282,125 @@ class OffsetRotation:
         return 'OffsetRotation({}, {})'.format(self.auto, self.angle)
 
 
-class Element:
+# A value of an instance computed by function when first read. It is then
+# stored in the instance's __dict__, which takes precedence over this
+# descriptor, until removed from there.
+class derived(object):
+    def __init__(self, function):
+        self.function = function
+        self.name = function.__name__
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        value = instance.__dict__[self.name] = self.function(instance)
+        return value
+
+
+# The placement of an element along its offset path. The vertices v,
+# path_length, computed_offset (for ray() paths only) and translation are
+# computed when first read. Assigning an input, directly or through update(),
+# discards only the values that depend on it, so that they are recomputed
+# when next read. Inputs are replaced rather than modified in place.
+# Assigning offset_distance to a path() element also locates it again along
+# its path, as frame() does, replacing offset_path.
+class Element(object):
+    # For each input or derived value, the derived values computed from it.
+    DEPENDENTS = {
+        'size': ('v',),
+        'offset_anchor': ('v',),
+        'offset_rotation': ('v',),
+        'offset_path': ('v', 'path_length', 'computed_offset', 'translation'),
+        'offset_position': ('path_length',),
+        'container_size': ('path_length',),
+        'offset_distance': ('computed_offset',),
+        'v': ('computed_offset',),
+        'path_length': ('computed_offset',),
+        'computed_offset': ('translation',),
+    }
+
     # offset-distance is a percentage of the path length
     # offset-position and offset-anchor are points
     def __init__(self, id, size, background_color, offset_path, offset_distance, offset_rotation, offset_position, offset_anchor, container_size):
-        self.id = id
-        self.size = size
-        self.background_color = background_color
-        self.offset_path = offset_path
-        self.offset_distance = offset_distance
-        self.offset_rotation = offset_rotation
-        self.offset_position = offset_position
-        self.offset_anchor = offset_anchor
-        self.container_size = container_size
-
-        if offset_path and offset_rotation.auto:
-            rotation = offset_rotation.angle + (offset_path.angle - 90)
+        self.__dict__.update(
+            id = id,
+            size = size,
+            background_color = background_color,
+            offset_path = offset_path,
+            offset_distance = offset_distance,
+            offset_rotation = offset_rotation,
+            offset_position = offset_position,
+            offset_anchor = offset_anchor,
+            container_size = container_size
+        )
+
+    def __setattr__(self, name, value):
+        self.__dict__[name] = value
+        self.invalidate(name)
+        if name == 'offset_distance' and isinstance(self.offset_path, StringPath):
+            self.offset_path = locate_on_path(self.offset_path.path, value)
+
+    # offset_distance is assigned first, so that an offset_path given with it
+    # is kept rather than located again.
+    def update(self, **inputs):
+        for name in sorted(inputs, key=lambda name: name != 'offset_distance'):
+            setattr(self, name, inputs[name])
+
+    def invalidate(self, name):
+        for dependent in Element.DEPENDENTS.get(name, ()):
+            if dependent == 'v' and name == 'offset_path' and not self.offset_rotation.auto:
+                # The rotation does not follow the path.
+                continue
+            if dependent == 'computed_offset' and name == 'v' and not (isinstance(self.offset_path, RayPath) and self.offset_path.contain):
+                # Only contain uses the vertices.
+                continue
+            self.__dict__.pop(dependent, None)
+            self.invalidate(dependent)
+
+    @derived
+    @timed('element')
+    def v(self):
+        return self.compute_vertices(self.offset_path)
+
+    @derived
+    @timed('element')
+    def path_length(self):
+        if isinstance(self.offset_path, RayPath):
+            return self.compute_path_length()
+        return 0
+
+    @derived
+    @timed('element')
+    def computed_offset(self):
+        if isinstance(self.offset_path, RayPath):
+            return self.compute_offset()
+        raise AttributeError('computed_offset')
+
+    @derived
+    @timed('element')
+    def translation(self):
+        if isinstance(self.offset_path, RayPath):
+            return self.compute_translation(self.computed_offset)
+        elif isinstance(self.offset_path, StringPath):
+            return Point(self.offset_path.x, self.offset_path.y)
         else:
-            rotation = offset_rotation.angle
+            return Point(0, 0)
 
-        self.v = map(rotate(rotation), [
+    def compute_vertices(self, offset_path):
+        size = self.size
+        offset_anchor = self.offset_anchor
+        if offset_path and self.offset_rotation.auto:
+            rotation = self.offset_rotation.angle + (offset_path.angle - 90)
+        else:
+            rotation = self.offset_rotation.angle
+
+        return map(rotate(rotation), [
             Point(-offset_anchor.x,             -offset_anchor.y),
             Point(size.width - offset_anchor.x, -offset_anchor.y),
             Point(size.width - offset_anchor.x, size.height - offset_anchor.y),
             Point(-offset_anchor.x,             size.height - offset_anchor.y)
         ])
 
-        if isinstance(offset_path, RayPath):
-            self.path_length = self.compute_path_length()
-            self.computed_offset = self.compute_offset()
-
-            self.translation = Point(
-                self.computed_offset * sin(radians(self.offset_path.angle)),
-                -self.computed_offset * cos(radians(self.offset_path.angle))
-            )
-        elif isinstance(offset_path, StringPath):
-            self.path_length = 0
-            self.translation = Point(self.offset_path.x, self.offset_path.y)
-        else:
-            self.path_length = 0
-            self.translation = Point(0, 0)
-
-
     def compute_path_length(self):
         x1 = fabs(self.offset_position.x)
         y1 = fabs(self.offset_position.y)
@@ -302,91 +426,140 @@ class Element:
         else:
             return sqrt(x*x + y*y)
 
-    def compute_offset(self):
-        radius = self.path_length
-        computed_offset = radius * self.offset_distance / 100.
+    def compute_offset(self, offset_distance=None):
+        if offset_distance is None:
+            offset_distance = self.offset_distance
+        computed_offset = self.path_length * offset_distance / 100.
         if not self.offset_path.contain:
             return computed_offset
-
-        epsilon = 0.0001
-        vertices = map(rotate(90 - self.offset_path.angle), self.v)
-        vertices.sort(key=lambda p: -fabs(p.y))
-
-        # Determine the offset interval such that all vertices lie within the path.
-        intervals = []
-        for v in vertices:
-            # We require (offset + x)**2 + y**2 <= radius**2
-            discriminant = radius * radius - v.y * v.y
-            if discriminant < 0:
-                break # no solution
-
-            intervals.append(Interval(-v.x - sqrt(discriminant), -v.x + sqrt(discriminant)))
-
-        if len(intervals) == len(vertices):
-            lower_bound = greatest_lower_bound(intervals)
-            upper_bound = least_upper_bound(intervals)
-            if lower_bound <= upper_bound:
-                return max(lower_bound, min(upper_bound, computed_offset))
-
-        # The path length will need to be increased.
-        # We find the smallest path length such that an offset exists for all vertices to lie within the path.
-
-        # v[0] is furthest from the x-axis.
-        radius = fabs(vertices[0].y)
-        offset = -vertices[0].x
-
-        for i in range(3):
-            for j in range(i+1, 4):
-                # Find the path length such that, for some offset, vertices[i] and vertices[j] both lie within the path.
-                xi = vertices[i].x
-                yi = vertices[i].y
-                xj = vertices[j].x
-                yj = vertices[j].y
-                xd = xi - xj
-
-                if xd * xd + yj * yj <= yi * yi + epsilon:
-                    # Any path that encloses vertices[i] would also enclose vertices[j].
-                    continue
-
-                # If both lie on the path,
-                # (offset + xi)**2 + yi**2 = (offset + xj)**2 + yj**2 = (path length)**2
-                # 2 * xi * offset + xi**2 + yi**2 = 2 * xj * offset + xj**2 + yj**2
-
-                candidate_offset = (xj * xj + yj * yj - xi * xi - yi * yi) / 2 / xd
-                xi += candidate_offset
-                xj += candidate_offset
-                candidate_radius = sqrt(xi * xi + yi * yi)  # == sqrt(xj * xj + yj * yj)
-                if radius < candidate_radius:
-                    radius = candidate_radius
-                    offset = candidate_offset
-
-        return offset
+        return contain_offset(self.v, self.offset_path.angle, self.path_length, computed_offset)
+
+    def compute_translation(self, computed_offset):
+        return Point(
+            computed_offset * sin(radians(self.offset_path.angle)),
+            -computed_offset * cos(radians(self.offset_path.angle))
+        )
+
+    # Returns (computed_offset, translation, v) for the element moved to
+    # offset_distance along its path. The path length and, unless the
+    # rotation follows a path() direction, the vertices are reused.
+    def frame(self, offset_distance):
+        if isinstance(self.offset_path, RayPath):
+            computed_offset = self.compute_offset(offset_distance)
+            return (computed_offset, self.compute_translation(computed_offset), self.v)
+        elif isinstance(self.offset_path, StringPath):
+            offset_path = locate_on_path(self.offset_path.path, offset_distance)
+            v = self.compute_vertices(offset_path) if self.offset_rotation.auto else self.v
+            return (None, Point(offset_path.x, offset_path.y), v)
+        else:
+            return (None, self.translation, self.v)
 
 
-JINJA_ENVIRONMENT = Environment(
-    loader=FileSystemLoader(path.dirname(__file__)),
-    extensions=['jinja2.ext.autoescape'],
-    autoescape=True)
+JINJA_ENVIRONMENT = AUTOESCAPE_ENVIRONMENT
 
 
 class MainPage(RequestHandler):
+    # The page does not depend on the request, so it is rendered once per
+    # instance, except under the development server where templates change.
+    body = None
+
     def get(self):
+        if MainPage.body is None or DEVELOPMENT:
+            MainPage.body = self.render()
+        self.response.write(MainPage.body)
+
+    def render(self):
         main_template = JINJA_ENVIRONMENT.get_template('templates/ray.html')
         item_template = JINJA_ENVIRONMENT.get_template('templates/item-fragment.html')
         item_script_template = JINJA_ENVIRONMENT.get_template('templates/item-script-fragment.html')
 
-        items = []
-        for index in range(1, 7):
-            item_template_values = { 'item': { 'number': index, 'display': 'none' } }
-            if index == 1:
-                item_template_values['item']['display'] = 'block'
-            items.append({
-                'specification': item_template.render(item_template_values),
-                'script': item_script_template.render(item_template_values),
-            })
+        with timer('render'):
+            items = []
+            for index in range(1, 7):
+                item_template_values = { 'item': { 'number': index, 'display': 'none' } }
+                if index == 1:
+                    item_template_values['item']['display'] = 'block'
+                items.append({
+                    'specification': item_template.render(item_template_values),
+                    'script': item_script_template.render(item_template_values),
+                })
+
+            main_template_values = { 'items': items }
+            return main_template.render(main_template_values)
+
+
+# Builds the Element described by the parameters of a single item.
+# getParam(name, default) looks up one parameter, e.g. 'width' or 'direction'.
+# Raises ValueError if the path of a path() item is not a string.
+def create_element(id, getParam, container_size):
+    def getFloatParam(name, default):
+        try:
+            return float(getParam(name, default))
+        except:
+            return default
+
+    width = getFloatParam('width', 10)
+    height = getFloatParam('height', 10)
+    background_color = getParam('background', '#8080FF')
+    position_x = getFloatParam('position_x', 50)
+    position_y = getFloatParam('position_y', 50)
+    path_function = getParam('function', 'ray')
+    ray_size = getParam('size', 'closest-side')
+    ray_contain = getParam('contain', 'unbounded')
+    ray_angle = getFloatParam('direction', 90)
+    distance = getFloatParam('distance', 100)
+    path = getParam('path', '')
+    path_x = getFloatParam('path_x', 0)
+    path_y = getFloatParam('path_y', 0)
+    path_dx = getFloatParam('path_dx', 0)
+    path_dy = getFloatParam('path_dy', 0)
+    rotation_auto = getParam('rotation_auto', '')
+    rotation_angle = getFloatParam('rotation_angle', 0)
+    anchor = getParam('anchor', '')
+    if anchor == '':
+        anchor_x = getFloatParam('anchor_x', 50)
+        anchor_y = getFloatParam('anchor_y', 50)
+    elif path_function == 'none':
+        anchor_x = position_x
+        anchor_y = position_y
+    else:
+        anchor_x = 50
+        anchor_y = 50
+
+    if path_function == 'ray':
+        offset_path = RayPath(ray_angle, ray_size, ray_contain == 'contain')
+    elif path_function == 'path':
+        if not isinstance(path, basestring):
+            raise ValueError('Expected a string path')
+        if getParam('path_x', '') == '':
+            # Not measured by the page, e.g. because its script did not run.
+            offset_path = locate_on_path(path, distance)
+        else:
+            offset_path = StringPath(path, path_x, path_y, path_dx, path_dy)
+    else:
+        offset_path = None
+
+    element_size = Size(width * container_size.width / 100.0, height * container_size.height / 100.0)
+    return Element(
+        id = id,
+        size = element_size,
+        background_color = background_color,
+        offset_path = offset_path,
+        offset_distance = distance,
+        offset_rotation = OffsetRotation(rotation_auto == 'auto', rotation_angle),
+        offset_position = Point(position_x * container_size.width / 100.0, position_y * container_size.height / 100.0),
+        offset_anchor = Point(anchor_x * element_size.width / 100.0, anchor_y * element_size.height / 100.0),
+        container_size = container_size
+    )
 
-        main_template_values = { 'items': items }
-        self.response.write(main_template.render(main_template_values))
+def element_to_dict(element):
+    return {
+        'id': element.id,
+        'path_length': element.path_length,
+        'computed_offset': getattr(element, 'computed_offset', None),
+        'translation': [element.translation.x, element.translation.y],
+        'vertices': [[vertex.x, vertex.y] for vertex in element.v],
+    }
 
 
 class PlotPage(RequestHandler):
@@ -395,7 +568,12 @@ class PlotPage(RequestHandler):
 
     def post(self):
         plot_template = JINJA_ENVIRONMENT.get_template('templates/plot.svg')
+        plot_template_values = self.plot_template_values()
+        self.response.headers.add_header('Content-Type', 'image/svg+xml')
+        with timer('render'):
+            self.response.write(plot_template.render(plot_template_values))
 
+    def plot_template_values(self):
         image_size = Size(700, 700)
         label_position = Point(96, 36)
         stroke_begin = Point(132, 45)
@@ -408,64 +586,10 @@ class PlotPage(RequestHandler):
             def getParam(name, default):
                 return self.request.get('item{}_{}'.format(index, name), default)
 
-            def getFloatParam(name, default):
-                try:
-                    return float(getParam(name, default))
-                except:
-                    return default
-
-            box = 'box{}'.format(index)
-            display = getParam('display', 'none')
-            width = getFloatParam('width', 10)
-            height = getFloatParam('height', 10)
-            background_color = getParam('background', '#8080FF')
-            position_x = getFloatParam('position_x', 50)
-            position_y = getFloatParam('position_y', 50)
-            path_function = getParam('function', 'ray')
-            ray_size = getParam('size', 'closest-side')
-            ray_contain = getParam('contain', 'unbounded')
-            ray_angle = getFloatParam('direction', 90)
-            distance = getFloatParam('distance', 100)
-            path = getParam('path', '')
-            path_x = getFloatParam('path_x', 0)
-            path_y = getFloatParam('path_y', 0)
-            path_dx = getFloatParam('path_dx', 0)
-            path_dy = getFloatParam('path_dy', 0)
-            rotation_auto = getParam('rotation_auto', '')
-            rotation_angle = getFloatParam('rotation_angle', 0)
-            anchor = getParam('anchor', '')
-            if anchor == '':
-                anchor_x = getFloatParam('anchor_x', 50)
-                anchor_y = getFloatParam('anchor_y', 50)
-            elif path_function == 'none':
-                anchor_x = position_x
-                anchor_y = position_y
-            else:
-                anchor_x = 50
-                anchor_y = 50
-
-            if path_function == 'ray':
-                offset_path = RayPath(ray_angle, ray_size, ray_contain == 'contain')
-            elif path_function == 'path':
-                offset_path = StringPath(path, path_x, path_y, path_dx, path_dy)
-            else:
-                offset_path = None
-
-            if display == 'block':
-                element_size = Size(width * container_size.width / 100.0, height * container_size.height / 100.0)
-                elements.append(Element(
-                    id = box,
-                    size = element_size,
-                    background_color = background_color,
-                    offset_path = offset_path,
-                    offset_distance = distance,
-                    offset_rotation = OffsetRotation(rotation_auto == 'auto', rotation_angle),
-                    offset_position = Point(position_x * container_size.width / 100.0, position_y * container_size.height / 100.0),
-                    offset_anchor = Point(anchor_x * element_size.width / 100.0, anchor_y * element_size.height / 100.0),
-                    container_size = container_size
-                ))
-
-        plot_template_values = {
+            if getParam('display', 'none') == 'block':
+                elements.append(create_element('box{}'.format(index), getParam, container_size))
+
+        return {
             'image_size': image_size,
             'label_position': label_position,
             'stroke_begin': stroke_begin,
@@ -474,10 +598,114 @@ class PlotPage(RequestHandler):
             'container_size': container_size,
             'elements': elements
         }
+
+
+MAX_SWEEP_FRAMES = 1000
+
+def format_points(points):
+    return ' '.join('{},{}'.format(point.x, point.y) for point in points)
+
+# Plots the elements of PlotPage as offset-distance sweeps from sweep_from to
+# sweep_to percent in sweep_frames steps. Responds with an SVG animating the
+# sweep over sweep_duration seconds or, if format is json, with the placement
+# of each element in each frame. Each element is built once, and only the
+# parts of its placement that depend on the distance are recomputed per frame.
+class SweepPage(PlotPage):
+    def post(self):
+        def getFloatParam(name, default):
+            try:
+                value = float(self.request.get(name, default))
+            except:
+                return default
+            if isinf(value) or isnan(value):
+                return default
+            return value
+
+        sweep_from = getFloatParam('sweep_from', 0)
+        sweep_to = getFloatParam('sweep_to', 100)
+        sweep_frames = max(1, min(MAX_SWEEP_FRAMES, int(getFloatParam('sweep_frames', 50))))
+        sweep_duration = max(0.001, getFloatParam('sweep_duration', 5))
+        if sweep_frames == 1:
+            distances = [sweep_from]
+        else:
+            distances = [sweep_from + (sweep_to - sweep_from) * frame / (sweep_frames - 1.) for frame in range(sweep_frames)]
+
+        plot_template_values = self.plot_template_values()
+        elements = plot_template_values['elements']
+        frames = [[element.frame(distance) for distance in distances] for element in elements]
+
+        if self.request.get('format') == 'json':
+            self.response.headers['Content-Type'] = 'application/json'
+            self.response.write(dumps([{
+                'offset_distance': distance,
+                'elements': [{
+                    'id': element.id,
+                    'computed_offset': element_frames[index][0],
+                    'translation': [element_frames[index][1].x, element_frames[index][1].y],
+                    'vertices': [[vertex.x, vertex.y] for vertex in element_frames[index][2]],
+                } for element, element_frames in zip(elements, frames)]
+            } for index, distance in enumerate(distances)]))
+            return
+
+        animations = {}
+        for element, element_frames in zip(elements, frames):
+            translations = [translation for (_, translation, _) in element_frames]
+            animation = {
+                'translations': ';'.join('{},{}'.format(translation.x, translation.y) for translation in translations),
+                'xs': ';'.join(str(translation.x) for translation in translations),
+                'ys': ';'.join(str(translation.y) for translation in translations),
+            }
+            if any(v is not element.v for (_, _, v) in element_frames):
+                animation['points'] = ';'.join(format_points(v) for (_, _, v) in element_frames)
+            animations[element.id] = animation
+
+        plot_template_values['animations'] = animations
+        plot_template_values['duration'] = sweep_duration
+        sweep_template = JINJA_ENVIRONMENT.get_template('templates/sweep.svg')
         self.response.headers.add_header('Content-Type', 'image/svg+xml')
-        self.response.write(plot_template.render(plot_template_values))
+        with timer('render'):
+            self.response.write(sweep_template.render(plot_template_values))
+
+
+# Returns the JSON line placing the element described by one line of
+# newline-delimited JSON, with the parameter names of PlotPage (without the
+# item{n}_ prefix), and whether it reports an error instead. Any failure is
+# reported for its line, so that the other lines are still placed.
+def place_line(index, line, container_size):
+    try:
+        specification = loads(line)
+        if not isinstance(specification, dict):
+            raise ValueError('Expected a JSON object')
+        element = create_element(specification.get('id', 'box{}'.format(index)), specification.get, container_size)
+        return (dumps(element_to_dict(element)) + '\n', False)
+    except ValueError as err:
+        error = str(err)
+    except Exception as err:
+        error = '{}: {}'.format(type(err).__name__, err)
+    return (dumps({ 'line': index, 'error': error }) + '\n', True)
+
+PLACEMENT_CONTAINER_SIZE = Size(500, 500)
+
+# Accepts newline-delimited JSON, one element per line as read by
+# place_line, and responds with one JSON line per element, produced as the
+# request body is read.
+class PlacementPage(RequestHandler):
+    def post(self):
+        lines = self.request.body_file
+
+        def placements():
+            for index, line in enumerate(lines, 1):
+                if line.strip() == '':
+                    continue
+                (result, _) = place_line(index, line, PLACEMENT_CONTAINER_SIZE)
+                yield result
+
+        self.response.headers['Content-Type'] = 'application/x-ndjson'
+        self.response.app_iter = placements()
 
-app = WSGIApplication([
+app = instrument(WSGIApplication([
     ('/ray/plot', PlotPage),
+    ('/ray/sweep', SweepPage),
+    ('/ray/placements', PlacementPage),
     ('/ray/', MainPage),
-])
+]))
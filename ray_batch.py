@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+
+# Array counterparts of the scalar geometry in ray.py, for evaluating many
+# ray placements at once. Each function mirrors the arithmetic of its scalar
+# counterpart step by step so that results agree with Element exactly.
+
+import numpy as np
+
+from ray import NEWTON_EPSILON
+
+RAY_SIZES = [
+    'closest-side',
+    'closest-corner',
+    'farthest-side',
+    'farthest-corner',
+    'sides',
+]
+
+def rotate_points(angles, xs, ys):
+    c = np.cos(np.radians(angles))
+    s = np.sin(np.radians(angles))
+    return (c * xs - s * ys, c * ys + s * xs)
+
+def distances_to_sides(distLeft, distTop, distRight, distBottom, angles):
+    sn = np.sin(angles)
+    cs = np.cos(angles)
+    distHorizontal = np.where(sn >= 0, distRight, distLeft)
+    sn = np.abs(sn)
+    distVertical = np.where(cs >= 0, distTop, distBottom)
+    cs = np.abs(cs)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(distVertical * sn <= distHorizontal * cs, distVertical / cs, distHorizontal / sn)
+
+def path_lengths(ray_sizes, angles, positions, container_sizes):
+    px = positions[:, 0]
+    py = positions[:, 1]
+    width = container_sizes[:, 0]
+    height = container_sizes[:, 1]
+
+    x1 = np.abs(px)
+    y1 = np.abs(py)
+    x2 = np.abs(width - px)
+    y2 = np.abs(height - py)
+
+    closest = (ray_sizes == 'closest-side') | (ray_sizes == 'closest-corner')
+    x = np.where(closest, np.minimum(x1, x2), np.maximum(x1, x2))
+    y = np.where(closest, np.minimum(y1, y2), np.maximum(y1, y2))
+
+    result = np.sqrt(x*x + y*y)
+    result = np.where(ray_sizes == 'closest-side', np.minimum(x, y), result)
+    result = np.where(ray_sizes == 'farthest-side', np.maximum(x, y), result)
+
+    sides = ray_sizes == 'sides'
+    if sides.any():
+        outside = (px <= 0) | (py <= 0) | (px >= width) | (py >= height)
+        result = np.where(sides, np.where(outside, 0., distances_to_sides(x1, y1, x2, y2, np.radians(angles))), result)
+    return result
+
+def contain_offsets(vertices, angles, radii, computed_offsets):
+    # vertices has shape (n, 4, 2), in order around each rectangle, as produced by place_elements.
+    epsilon = 0.0001
+    n = len(radii)
+    xs, ys = rotate_points((90 - angles)[:, np.newaxis], vertices[:, :, 0], vertices[:, :, 1])
+
+    # Determine the offset interval such that all vertices lie within the path.
+    result = computed_offsets.copy()
+    discriminants = radii[:, np.newaxis] * radii[:, np.newaxis] - ys * ys
+    solvable = (discriminants >= 0).all(axis=1)
+    roots = np.sqrt(np.where(discriminants >= 0, discriminants, 0.))
+    lower_bounds = (-xs - roots).max(axis=1)
+    upper_bounds = (-xs + roots).min(axis=1)
+    feasible = solvable & (lower_bounds <= upper_bounds)
+    result[feasible] = np.maximum(lower_bounds, np.minimum(upper_bounds, computed_offsets))[feasible]
+
+    # The path length will need to be increased.
+    # We find the smallest path length such that an offset exists for all vertices to lie within the path.
+    # As in ray.contain_offset, only the pairs of vertices along each edge are considered.
+    rows = np.arange(n)
+    furthest = np.argmax(np.abs(ys), axis=1)
+    radius = np.abs(ys[rows, furthest])
+    offset = -xs[rows, furthest]
+    for k in range(4):
+        j = (k + 1) % 4
+        swap = (np.abs(ys[:, j]) > np.abs(ys[:, k])) | ((j == 0) & (np.abs(ys[:, j]) == np.abs(ys[:, k])))
+        xi = np.where(swap, xs[:, j], xs[:, k])
+        yi = np.where(swap, ys[:, j], ys[:, k])
+        xj = np.where(swap, xs[:, k], xs[:, j])
+        yj = np.where(swap, ys[:, k], ys[:, j])
+        xd = xi - xj
+
+        enclosed = xd * xd + yj * yj <= yi * yi + epsilon
+        with np.errstate(divide='ignore', invalid='ignore'):
+            candidate_offset = (xj * xj + yj * yj - xi * xi - yi * yi) / 2 / xd
+            xi = xi + candidate_offset
+            candidate_radius = np.sqrt(xi * xi + yi * yi)
+            better = ~enclosed & (radius < candidate_radius)
+        radius = np.where(better, candidate_radius, radius)
+        offset = np.where(better, candidate_offset, offset)
+
+    result[~feasible] = offset[~feasible]
+    return result
+
+
+# Twice the signed area of the sector of the unit circle between the
+# directions of u and v.
+def sector_angles(ux, uy, vx, vy):
+    return np.arctan2(ux * vy - uy * vx, ux * vx + uy * vy)
+
+# Twice the signed area of the intersection of the unit circle with the
+# triangle formed by the origin and the edge from (ax, ay) to (bx, by).
+# The edge is split where it crosses the circle: the part inside
+# contributes a triangle, the parts outside contribute sectors.
+def edge_areas(ax, ay, bx, by):
+    dx = bx - ax
+    dy = by - ay
+
+    # Circle: |a + t d|**2 = 1
+    # (d.d) t**2 + 2 (a.d) t + (a.a - 1) = 0
+    a = dx * dx + dy * dy
+    b = ax * dx + ay * dy
+    c = ax * ax + ay * ay - 1
+    discriminant = b * b - a * c
+    crosses = (discriminant > 0) & (a > 0)
+    root = np.sqrt(np.where(crosses, discriminant, 0.))
+    safe_a = np.where(crosses, a, 1.)
+    t1 = np.where(crosses, np.clip((-b - root) / safe_a, 0, 1), 0.)
+    t2 = np.where(crosses, np.clip((-b + root) / safe_a, 0, 1), 0.)
+
+    x1 = ax + t1 * dx
+    y1 = ay + t1 * dy
+    x2 = ax + t2 * dx
+    y2 = ay + t2 * dy
+    return (sector_angles(ax, ay, x1, y1)
+            + (x1 * y2 - y1 * x2)
+            + sector_angles(x2, y2, bx, by))
+
+# The area of intersection between each triangle and the unit circle,
+# as computed by ray.area_inside_unit_circle. p1, p2 and p3 have shape
+# (n, 2) and hold the vertices of n triangles.
+def areas_inside_unit_circle(p1, p2, p3):
+    p1 = np.asarray(p1, dtype=float)
+    p2 = np.asarray(p2, dtype=float)
+    p3 = np.asarray(p3, dtype=float)
+    total = (edge_areas(p1[:, 0], p1[:, 1], p2[:, 0], p2[:, 1])
+             + edge_areas(p2[:, 0], p2[:, 1], p3[:, 0], p3[:, 1])
+             + edge_areas(p3[:, 0], p3[:, 1], p1[:, 0], p1[:, 1]))
+    return np.abs(total) / 2
+
+
+class NewtonBatchResult:
+    def __init__(self, x, converged, iterations, evaluations):
+        self.x = x
+        self.converged = converged
+        self.iterations = iterations
+        self.evaluations = evaluations
+    def __str__(self):
+        return 'NewtonBatchResult({})'.format(len(self.x))
+
+# The array counterpart of ray.newton_search, searching from every starting
+# point in x0 at once. The functions are applied elementwise to arrays of
+# the points still being searched; converged, iterations and evaluations
+# are reported for each starting point.
+def newton_search(function, x0, derivative=None, second_derivative=None, tolerance=NEWTON_EPSILON, max_iterations=10):
+    EPSILON = NEWTON_EPSILON
+    x = np.array(x0, dtype=float, ndmin=1)
+    converged = np.zeros(len(x), dtype=bool)
+    iterations = np.zeros(len(x), dtype=int)
+    evaluations = np.zeros(len(x), dtype=int)
+    active = np.arange(len(x))
+
+    for iteration in range(max_iterations):
+        if len(active) == 0:
+            break
+        xa = x[active]
+        if derivative is None:
+            fp = function(xa + EPSILON)
+            f = function(xa)
+            fm = function(xa - EPSILON)
+            evaluations[active] += 3
+
+            fd = (fp - fm) / (2 * EPSILON)
+            fdd = (fp + fm - 2 * f) / (EPSILON**2)
+        elif second_derivative is None:
+            fd = derivative(xa)
+            fdd = (derivative(xa + EPSILON) - derivative(xa - EPSILON)) / (2 * EPSILON)
+            evaluations[active] += 3
+        else:
+            fd = derivative(xa)
+            fdd = second_derivative(xa)
+            evaluations[active] += 2
+
+        done = (np.abs(fd) < tolerance) | (np.abs(fdd) < EPSILON)
+        converged[active[done]] = np.abs(fd[done]) < tolerance
+        iterations[active[done]] = iteration
+
+        step = ~done
+        x[active[step]] = xa[step] - fd[step] / fdd[step]
+        active = active[step]
+
+    iterations[active] = max_iterations
+    return NewtonBatchResult(x, converged, iterations, evaluations)
+
+
+class PlacementBatch:
+    def __init__(self, v, path_length, computed_offset, translation):
+        self.v = v
+        self.path_length = path_length
+        self.computed_offset = computed_offset
+        self.translation = translation
+    def __len__(self):
+        return len(self.path_length)
+    def __str__(self):
+        return 'PlacementBatch({})'.format(len(self))
+
+
+# Computes, for n elements placed along ray() paths, the same values
+# as Element: v has shape (n, 4, 2), translation has shape (n, 2), and
+# path_length and computed_offset have shape (n,).
+# Sizes, anchors, positions and container sizes are (width, height) or
+# (x, y) pairs in pixels; any argument may be given once for all elements.
+def place_elements(sizes, anchors, positions, angles, distances, ray_sizes, contain=False, rotation_auto=True, rotation_angles=0, container_sizes=(500, 500)):
+    angles = np.atleast_1d(np.asarray(angles, dtype=float))
+    n = max(len(np.atleast_1d(np.asarray(argument))) for argument in [angles, distances, ray_sizes, contain, rotation_auto, rotation_angles])
+    n = max([n] + [len(np.atleast_2d(argument)) for argument in [sizes, anchors, positions, container_sizes]])
+
+    def pairs(argument):
+        return np.array(np.broadcast_arrays(np.atleast_2d(np.asarray(argument, dtype=float)), np.zeros((n, 2)))[0])
+
+    def values(argument, dtype):
+        return np.array(np.broadcast_arrays(np.atleast_1d(np.asarray(argument, dtype=dtype)), np.zeros(n))[0])
+
+    sizes = pairs(sizes)
+    anchors = pairs(anchors)
+    positions = pairs(positions)
+    container_sizes = pairs(container_sizes)
+    angles = values(angles, float)
+    distances = values(distances, float)
+    contain = values(contain, bool)
+    rotation_auto = values(rotation_auto, bool)
+    rotation_angles = values(rotation_angles, float)
+    ray_sizes = values(ray_sizes, object)
+    ray_sizes = np.where([size in RAY_SIZES for size in ray_sizes], ray_sizes, 'closest-side').astype(object)
+
+    rotations = np.where(rotation_auto, rotation_angles + (angles - 90), rotation_angles)
+    left = -anchors[:, 0]
+    top = -anchors[:, 1]
+    right = sizes[:, 0] - anchors[:, 0]
+    bottom = sizes[:, 1] - anchors[:, 1]
+    xs = np.array([left, right, right, left]).T
+    ys = np.array([top, top, bottom, bottom]).T
+    xs, ys = rotate_points(rotations[:, np.newaxis], xs, ys)
+    v = np.dstack([xs, ys])
+
+    path_length = path_lengths(ray_sizes, angles, positions, container_sizes)
+    computed_offset = path_length * distances / 100.
+    if contain.any():
+        computed_offset[contain] = contain_offsets(v[contain], angles[contain], path_length[contain], computed_offset[contain])
+
+    translation = np.array([
+        computed_offset * np.sin(np.radians(angles)),
+        -computed_offset * np.cos(np.radians(angles))
+    ]).T
+
+    return PlacementBatch(v, path_length, computed_offset, translation)
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+from errno import EEXIST
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+from os import environ, makedirs, path
+
+ROOT = path.dirname(path.abspath(__file__))
+TEMPLATES_DIRECTORY = 'templates'
+BYTECODE_DIRECTORY = path.join(ROOT, TEMPLATES_DIRECTORY, 'bytecode')
+
+# Templates only change while running under dev_appserver.py, so elsewhere
+# they are never checked for changes once loaded.
+DEVELOPMENT = environ.get('SERVER_SOFTWARE', '').startswith('Development')
+
+# Reads compiled templates from BYTECODE_DIRECTORY, which is filled before
+# deployment by running this module. Bytecode is keyed by a checksum of the
+# template source, so edited templates are recompiled rather than served
+# stale. The deployed file system is read only, so failures to write new
+# bytecode are ignored.
+class BytecodeCache(FileSystemBytecodeCache):
+  def dump_bytecode(self, bucket):
+    try:
+      FileSystemBytecodeCache.dump_bytecode(self, bucket)
+    except (IOError, OSError):
+      pass
+
+def create_environment(name, autoescape):
+  return Environment(
+      loader=FileSystemLoader(ROOT),
+      extensions=['jinja2.ext.autoescape'],
+      autoescape=autoescape,
+      auto_reload=DEVELOPMENT,
+      bytecode_cache=BytecodeCache(BYTECODE_DIRECTORY, '%s.' + name + '.cache'))
+
+# Shared by the handlers: the HTML pages escape their values by default,
+# while position.py renders its templates unescaped.
+AUTOESCAPE_ENVIRONMENT = create_environment('autoescape', True)
+PLAIN_ENVIRONMENT = create_environment('plain', False)
+
+def template_names():
+  return AUTOESCAPE_ENVIRONMENT.list_templates(filter_func=lambda name: name.startswith(TEMPLATES_DIRECTORY + '/') and not name.startswith(path.relpath(BYTECODE_DIRECTORY, ROOT) + '/'))
+
+# Compiles every template for each environment into BYTECODE_DIRECTORY.
+def compile_templates():
+  try:
+    makedirs(BYTECODE_DIRECTORY)
+  except OSError as err:
+    if err.errno != EEXIST:
+      raise
+
+  for name in template_names():
+    for environment in [AUTOESCAPE_ENVIRONMENT, PLAIN_ENVIRONMENT]:
+      environment.get_template(name)
+    print 'Compiled', name
+
+if __name__ == '__main__':
+  compile_templates()
@@ -1,15 +1,11 @@
 #!/usr/bin/env python
 
 from google.appengine.api.mail import send_mail
-from jinja2 import Environment, FileSystemLoader
-from os import path
+from rendering import AUTOESCAPE_ENVIRONMENT
 from webapp2 import RequestHandler, WSGIApplication
 
 
-JINJA_ENVIRONMENT = Environment(
-    loader=FileSystemLoader(path.dirname(__file__)),
-    extensions=['jinja2.ext.autoescape'],
-    autoescape=True)
+JINJA_ENVIRONMENT = AUTOESCAPE_ENVIRONMENT
 
 
 class MainPage(RequestHandler):
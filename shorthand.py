@@ -1,11 +1,21 @@
 #!/usr/bin/env python
 
 from abc import ABCMeta, abstractmethod
-from itertools import chain, permutations, product
-from jinja2 import Environment, escape, FileSystemLoader
-from os import path
+from cache import LRUCache, TieredCache
+from instrumentation import instrument, timed, timer
+from itertools import chain, islice, permutations, product
+from jinja2 import escape
+from re import compile, escape as escape_pattern, UNICODE
+from rendering import AUTOESCAPE_ENVIRONMENT
 from webapp2 import RequestHandler, WSGIApplication
 
+try:
+  from google.appengine.api import memcache
+except ImportError:
+  # Outside App Engine, e.g. under benchmark.py, analyses are only cached in
+  # this process.
+  memcache = None
+
 LONGHANDS = [
   '<angle>',
   '<basic-shape>',
@@ -67,24 +77,30 @@ class GrammarError(Exception):
     def __init__(self, message):
         self.message = message
 
+# Alternatives are tried in order, so as with TOKENS the first listed token
+# that matches wins. Each token has its own group, identifying it by index.
+TOKEN_PATTERN = compile(r'\s+|' + '|'.join('(' + escape_pattern(token) + ')' for token in TOKENS), UNICODE)
+
 # returns a list of atoms
+@timed('tokenise')
 def tokenise(grammar):
   result = []
   position = 0
   while position < len(grammar):
-    if grammar[position].isspace():
-      position += 1
-      continue
-
-    for token in TOKENS:
-      if grammar[position:position+len(token)] == token:
-        result.append(token)
-        position += len(token)
-        break
-    else:
+    match = TOKEN_PATTERN.match(grammar, position)
+    if match is None:
       raise GrammarError('Unknown token at "{}"'.format(grammar[position:]))
+    if match.lastindex is not None:
+      result.append(TOKENS[match.lastindex - 1])
+    position = match.end()
   return result
 
+# Expansions are shared by all structurally identical nodes, across requests.
+# The cache is bounded by the total number of expansions held, as a single
+# grammar may have hundreds of thousands.
+EXPANSION_CACHE_SIZE = 200000
+EXPANSION_CACHE = LRUCache(EXPANSION_CACHE_SIZE, len)
+
 class Node(object):
   __metaclass__ = ABCMeta
   def __init__(self):
@@ -94,13 +110,44 @@ class Node(object):
   def atoms(self):
     pass
 
+  # returns an iterable of tuples of atoms
   @abstractmethod
+  def expand(self):
+    pass
+
+  # returns a tuple of tuples of atoms
+  @timed('expansions')
   def expansions(self):
+    result = EXPANSION_CACHE.get(self.key)
+    if result is None:
+      result = tuple(self.expand())
+      EXPANSION_CACHE[self.key] = result
+    return result
+
+  # yields tuples of atoms, in the same order as expansions(), without
+  # holding them all in memory
+  @abstractmethod
+  def iterexpand(self):
     pass
 
+  def iterexpansions(self):
+    if self.key in EXPANSION_CACHE:
+      return iter(self.expansions())
+    return self.iterexpand()
+
+# yields the concatenations of one expansion from each node, in the order of product()
+def iter_sequence(nodes):
+  if len(nodes) == 0:
+    yield ()
+    return
+  for first in nodes[0].iterexpansions():
+    for rest in iter_sequence(nodes[1:]):
+      yield first + rest
+
 class Atom(Node):
   def __init__(self, value):
     self.value = value
+    self.key = ('Atom', value)
 
   def __str__(self):
     return str(self.value)
@@ -108,12 +155,17 @@ class Atom(Node):
   def atoms(self):
     return [self.value]
 
-  def expansions(self):
-    return [[self.value]]
+  def expand(self):
+    return [(self.value,)]
+
+  def iterexpand(self):
+    yield (self.value,)
 
 class Bracketed(Node):
   def __init__(self, body):
     self.body = body
+    # Brackets only group, so share the body's expansions.
+    self.key = body.key
 
   def __str__(self):
     return '[ ' + str(self.body) + ' ]'
@@ -121,12 +173,16 @@ class Bracketed(Node):
   def atoms(self):
     return self.body.atoms()
 
-  def expansions(self):
+  def expand(self):
     return self.body.expansions()
 
+  def iterexpand(self):
+    return self.body.iterexpansions()
+
 class Exclamation(Node):
   def __init__(self, body):
     self.body = body
+    self.key = ('Exclamation', body.key)
 
   def __str__(self):
     return str(self.body) + '!'
@@ -134,12 +190,16 @@ class Exclamation(Node):
   def atoms(self):
     return self.body.atoms()
 
-  def expansions(self):
+  def expand(self):
     return [item for item in self.body.expansions() if len(item) > 0]
 
+  def iterexpand(self):
+    return (item for item in self.body.iterexpansions() if len(item) > 0)
+
 class Question(Node):
   def __init__(self, body):
     self.body = body
+    self.key = ('Question', body.key)
 
   def __str__(self):
     return str(self.body) + '?'
@@ -147,12 +207,16 @@ class Question(Node):
   def atoms(self):
     return self.body.atoms()
 
-  def expansions(self):
-    return chain([[]], self.body.expansions())
+  def expand(self):
+    return chain([()], self.body.expansions())
+
+  def iterexpand(self):
+    return chain([()], self.body.iterexpansions())
 
 class Juxtaposition(Node):
   def __init__(self, contents):
     self.contents = contents
+    self.key = ('Juxtaposition',) + tuple(node.key for node in contents)
 
   def __str__(self):
     return ' '.join(map(str, self.contents))
@@ -160,12 +224,16 @@ class Juxtaposition(Node):
   def atoms(self):
     return [atom for node in self.contents for atom in node.atoms()]
 
-  def expansions(self):
-    return [list(chain(*list(expansion))) for expansion in product(*map(lambda item: item.expansions(), self.contents))]
+  def expand(self):
+    return [tuple(chain(*expansion)) for expansion in product(*map(lambda item: item.expansions(), self.contents))]
+
+  def iterexpand(self):
+    return iter_sequence(self.contents)
 
 class DoubleAmperstand(Node):
   def __init__(self, contents):
     self.contents = contents
+    self.key = ('DoubleAmperstand',) + tuple(node.key for node in contents)
 
   def __str__(self):
     return ' && '.join(map(str, self.contents))
@@ -173,12 +241,16 @@ class DoubleAmperstand(Node):
   def atoms(self):
     return [atom for node in self.contents for atom in node.atoms()]
 
-  def expansions(self):
-    return [list(chain(*list(expansion))) for sequence in permutations(self.contents) for expansion in product(*map(lambda item: item.expansions(), sequence))]
+  def expand(self):
+    return [tuple(chain(*expansion)) for sequence in permutations(self.contents) for expansion in product(*map(lambda item: item.expansions(), sequence))]
+
+  def iterexpand(self):
+    return (expansion for sequence in permutations(self.contents) for expansion in iter_sequence(sequence))
 
 class DoubleBar(Node):
   def __init__(self, contents):
     self.contents = contents
+    self.key = ('DoubleBar',) + tuple(node.key for node in contents)
 
   def __str__(self):
     return ' || '.join(map(str, self.contents))
@@ -186,12 +258,16 @@ class DoubleBar(Node):
   def atoms(self):
     return [atom for node in self.contents for atom in node.atoms()]
 
-  def expansions(self):
-    return [list(chain(*list(expansion))) for r in range(1, len(self.contents)+1) for sequence in permutations(self.contents, r) for expansion in product(*map(lambda item: item.expansions(), sequence))]
+  def expand(self):
+    return [tuple(chain(*expansion)) for r in range(1, len(self.contents)+1) for sequence in permutations(self.contents, r) for expansion in product(*map(lambda item: item.expansions(), sequence))]
+
+  def iterexpand(self):
+    return (expansion for r in range(1, len(self.contents)+1) for sequence in permutations(self.contents, r) for expansion in iter_sequence(sequence))
 
 class SingleBar(Node):
   def __init__(self, contents):
     self.contents = contents
+    self.key = ('SingleBar',) + tuple(node.key for node in contents)
 
   def __str__(self):
     return ' | '.join(map(str, self.contents))
@@ -199,94 +275,137 @@ class SingleBar(Node):
   def atoms(self):
     return [atom for node in self.contents for atom in node.atoms()]
 
-  def expansions(self):
+  def expand(self):
     return chain(*[item.expansions() for item in self.contents])
 
-def parse(tokens):
-  remaining = list(tokens)
-  remaining.append(None)
-  (result, remaining) = parseSingleBar(remaining)
-  if remaining != [None]:
-    # e.g. superflous ] in '[/]]'
-    raise GrammarError('Unexpected input at "{}"'.format(' '.join(remaining[:-1])))
-  return result
+  def iterexpand(self):
+    return chain.from_iterable(item.iterexpansions() for item in self.contents)
 
-def parseSingleBar(remaining):
-  (first, remaining) = parseDoubleBar(remaining)
-  result = [first]
-  while remaining[0] == '|':
-    (next, remaining) = parseDoubleBar(remaining[1:])
-    result.append(next)
-
-  if len(result) == 1:
-    return (result[0], remaining)
-  return (SingleBar(result), remaining)
-
-def parseDoubleBar(remaining):
-  (first, remaining) = parseDoubleAmperstand(remaining)
-  result = [first]
-  while remaining[0] == '||':
-    (next, remaining) = parseDoubleAmperstand(remaining[1:])
-    result.append(next)
-
-  if len(result) == 1:
-    return (result[0], remaining)
-  return (DoubleBar(result), remaining)
-
-def parseDoubleAmperstand(remaining):
-  (first, remaining) = parseJuxtaposition(remaining)
-  result = [first]
-  while remaining[0] == '&&':
-    (next, remaining) = parseJuxtaposition(remaining[1:])
-    result.append(next)
-
-  if len(result) == 1:
-    return (result[0], remaining)
-  return (DoubleAmperstand(result), remaining)
-
-def parseJuxtaposition(remaining):
-  (first, remaining) = parseSingle(remaining)
-  result = [first]
-  while remaining[0] not in [']', '&&', '||', '|', None]:
-    (next, remaining) = parseSingle(remaining)
-    result.append(next)
-
-  if len(result) == 1:
-    return (result[0], remaining)
-  return (Juxtaposition(result), remaining)
-
-def parseSingle(remaining):
-  if remaining[0] == '[':
-    (body, remaining) = parseSingleBar(remaining[1:])
-    if remaining[0] != ']':
-      raise GrammarError('Expected ] at "{}"'.format(' '.join(remaining[:-1])))
-    body = Bracketed(body)
-    remaining = remaining[1:]
-  elif remaining[0] in ATOMS:
-    body = Atom(remaining[0])
-    remaining = remaining[1:]
-    if remaining[0] == '!':
-      raise GrammarError('Unexpected ! after {}'.format(str(body)))
-  elif remaining[0] == None:
-    raise GrammarError('Unexpected end of input')
-  else:
-    raise GrammarError('Unexpected token at "{}"'.format(' '.join(remaining[:-1])))
-
-  if remaining[0] == '!':
-    return (Exclamation(body), remaining[1:])
-
-  if remaining[0] == '?':
-    return (Question(body), remaining[1:])
-
-  return (body, remaining)
+@timed('parse')
+def parse(tokens):
+  return Parser(tokens).parse()
+
+# A recursive descent parser, reading tokens by index.
+class Parser(object):
+  def __init__(self, tokens):
+    self.tokens = list(tokens)
+    self.tokens.append(None)
+    self.position = 0
+
+  def next(self):
+    return self.tokens[self.position]
+
+  def remaining(self):
+    return ' '.join(self.tokens[self.position:-1])
+
+  def parse(self):
+    result = self.parseSingleBar()
+    if self.next() is not None:
+      # e.g. superflous ] in '[/]]'
+      raise GrammarError('Unexpected input at "{}"'.format(self.remaining()))
+    return result
+
+  def parseSingleBar(self):
+    result = [self.parseDoubleBar()]
+    while self.next() == '|':
+      self.position += 1
+      result.append(self.parseDoubleBar())
+
+    if len(result) == 1:
+      return result[0]
+    return SingleBar(result)
+
+  def parseDoubleBar(self):
+    result = [self.parseDoubleAmperstand()]
+    while self.next() == '||':
+      self.position += 1
+      result.append(self.parseDoubleAmperstand())
+
+    if len(result) == 1:
+      return result[0]
+    return DoubleBar(result)
+
+  def parseDoubleAmperstand(self):
+    result = [self.parseJuxtaposition()]
+    while self.next() == '&&':
+      self.position += 1
+      result.append(self.parseJuxtaposition())
+
+    if len(result) == 1:
+      return result[0]
+    return DoubleAmperstand(result)
+
+  def parseJuxtaposition(self):
+    result = [self.parseSingle()]
+    while self.next() not in [']', '&&', '||', '|', None]:
+      result.append(self.parseSingle())
+
+    if len(result) == 1:
+      return result[0]
+    return Juxtaposition(result)
+
+  def parseSingle(self):
+    if self.next() == '[':
+      self.position += 1
+      body = self.parseSingleBar()
+      if self.next() != ']':
+        raise GrammarError('Expected ] at "{}"'.format(self.remaining()))
+      body = Bracketed(body)
+      self.position += 1
+    elif self.next() in ATOMS:
+      body = Atom(self.next())
+      self.position += 1
+      if self.next() == '!':
+        raise GrammarError('Unexpected ! after {}'.format(str(body)))
+    elif self.next() == None:
+      raise GrammarError('Unexpected end of input')
+    else:
+      raise GrammarError('Unexpected token at "{}"'.format(self.remaining()))
+
+    if self.next() == '!':
+      self.position += 1
+      return Exclamation(body)
+
+    if self.next() == '?':
+      self.position += 1
+      return Question(body)
+
+    return body
+
+# Items are compared through a hashable key, so that duplicates are found
+# in linear time. Expansions are tuples of atoms, and atoms are interned
+# token strings, so they are their own keys; lists are keyed as tuples.
+def canonical(item):
+  if isinstance(item, list):
+    return tuple(item)
+  return item
+
+# yields the first occurrence of each item, in order
+def iter_unique(sequence):
+  seen = set()
+  for item in sequence:
+    key = canonical(item)
+    if key not in seen:
+      seen.add(key)
+      yield item
+
+# yields the second occurrence of each item, in order
+def iter_repeated(sequence):
+  seen = set()
+  reported = set()
+  for item in sequence:
+    key = canonical(item)
+    if key not in seen:
+      seen.add(key)
+    elif key not in reported:
+      reported.add(key)
+      yield item
 
 def unique(sequence):
-  items = list(sequence)
-  return [item for index,item in enumerate(items) if items.index(item) == index]
+  return list(iter_unique(sequence))
 
 def repeated(sequence):
-  items = list(sequence)
-  return sorted(set([item for index,item in enumerate(items) if items.index(item) < index]))
+  return sorted(map(canonical, iter_repeated(sequence)))
 
 ANGLE_VALUES = [
   '0deg'
@@ -365,23 +484,177 @@ SEPARATOR_EXPANSIONS = dict((separator, [separator]) for separator in SEPARATORS
 
 ATOM_EXPANSIONS = dict(chain(LONGHAND_EXPANSIONS.iteritems(), SEPARATOR_EXPANSIONS.iteritems()))
 
+# When lazy, expansions are generated on demand instead of being
+# held in self.expansions, and duplicates are detected as they appear.
 class AmbiguitySearch(object):
-  def __init__(self, root):
+  def __init__(self, root, lazy=False):
     self.root = root
     atoms = set(root.atoms())
     atoms.discard('/')
     self.longhands = list(atoms)
 
-    self.expansions = unique(root.expansions())
-
-  def search(self):
-    possibilities = list([' '.join(concrete) for expansion in self.expansions for concrete in product(*map(lambda atom: ATOM_EXPANSIONS[atom], expansion))])
-    return repeated(possibilities)
+    if lazy:
+      self.expansions = None
+    else:
+      self.expansions = unique(self.root.expansions())
+
+  def iterexpansions(self):
+    if self.expansions is not None:
+      return iter(self.expansions)
+    return iter_unique(self.root.iterexpansions())
+
+  # yields each concrete value that can be produced in more than one way, once
+  def iterambiguities(self):
+    return iter_repeated(' '.join(concrete) for expansion in self.iterexpansions() for concrete in product(*map(lambda atom: ATOM_EXPANSIONS[atom], expansion)))
+
+  # returns the sorted ambiguities, stopping after the first limit are found
+  @timed('search')
+  def search(self, limit=None):
+    return sorted(islice(self.iterambiguities(), limit))
+
+# Finds the same ambiguities as AmbiguitySearch without enumerating every
+# combination of concrete values.
+#
+# The expansions are arranged in a trie of atoms, and each atom edge is
+# replaced by one chain of word transitions per concrete value, giving an
+# automaton with exactly one path for each way of producing a concrete value.
+# A value is ambiguous when two distinct paths spell it, so we walk pairs of
+# states in step, only following pairs that can still reach an ambiguous
+# value. The cost grows with the number of distinct concrete words rather than
+# with the product of the number of values of each atom.
+class SymbolicAmbiguitySearch(AmbiguitySearch):
+  def __init__(self, root, lazy=False):
+    super(SymbolicAmbiguitySearch, self).__init__(root, lazy)
+    self.transitions = [{}]
+    self.accepting = set()
+    self.viable = {}
+
+    children = {}
+    for expansion in self.iterexpansions():
+      state = 0
+      for atom in expansion:
+        child = children.get((state, atom))
+        if child is None:
+          child = self.add_state()
+          for value in ATOM_EXPANSIONS[atom]:
+            self.add_words(state, value.split(' '), child)
+          children[(state, atom)] = child
+        state = child
+      self.accepting.add(state)
+
+  def add_state(self):
+    self.transitions.append({})
+    return len(self.transitions) - 1
+
+  def add_words(self, state, words, target):
+    for word in words[:-1]:
+      following = self.add_state()
+      self.transitions[state].setdefault(word, []).append(following)
+      state = following
+    self.transitions[state].setdefault(words[-1], []).append(target)
+
+  # yields (first, second, diverged) for the pairs of states reached by
+  # reading the same word from first and second. Each unordered pair of
+  # distinct paths is only considered once.
+  def successors(self, first, second, diverged):
+    other = self.transitions[second]
+    for word, firsts in self.transitions[first].iteritems():
+      for next_first in firsts:
+        for next_second in other.get(word, ()):
+          if not diverged and next_first > next_second:
+            continue
+          yield (next_first, next_second, diverged or next_first != next_second)
+
+  # whether some value is read along two distinct paths from this pair of
+  # states, having already diverged or diverging later
+  def is_viable(self, first, second, diverged):
+    if diverged and first > second:
+      (first, second) = (second, first)
+    key = (first, second, diverged)
+    result = self.viable.get(key)
+    if result is None:
+      result = (diverged and first in self.accepting and second in self.accepting) or any(
+        self.is_viable(next_first, next_second, next_diverged)
+        for (next_first, next_second, next_diverged) in self.successors(first, second, diverged))
+      self.viable[key] = result
+    return result
+
+  # paths maps each state reached by the words read so far to the number of
+  # paths reaching it, counting no further than 2.
+  def is_ambiguous_from(self, paths):
+    states = paths.keys()
+    for index, first in enumerate(states):
+      if self.is_viable(first, first, paths[first] > 1):
+        return True
+      for second in states[index+1:]:
+        if self.is_viable(first, second, True):
+          return True
+    return False
+
+  def iterwalk(self, paths, words):
+    if sum(count for (state, count) in paths.iteritems() if state in self.accepting) > 1:
+      yield ' '.join(words)
+
+    following = {}
+    for (state, count) in paths.iteritems():
+      for word, targets in self.transitions[state].iteritems():
+        reached = following.setdefault(word, {})
+        for target in targets:
+          reached[target] = min(2, reached.get(target, 0) + count)
+
+    for word in sorted(following):
+      if self.is_ambiguous_from(following[word]):
+        words.append(word)
+        for possibility in self.iterwalk(following[word], words):
+          yield possibility
+        words.pop()
+
+  def iterambiguities(self):
+    return self.iterwalk({ 0: 1 }, [])
+
+SEARCH_ENGINES = {
+  'concrete': AmbiguitySearch,
+  'symbolic': SymbolicAmbiguitySearch,
+}
 
-JINJA_ENVIRONMENT = Environment(
-    loader=FileSystemLoader(path.dirname(__file__)),
-    extensions=['jinja2.ext.autoescape'],
-    autoescape=True)
+# The outcome of checking a grammar: its sorted expansions, and any
+# ambiguities or other error found.
+class Analysis(object):
+  def __init__(self, tokens, engine, limit):
+    self.expansions = []
+    self.accepts_empty = False
+    self.ambiguities = []
+    self.error = ''
+    try:
+      root = parse(tokens)
+      ambiguitySearch = SEARCH_ENGINES[engine](root)
+      self.expansions = sorted(map(lambda expansion: ' '.join(expansion), ambiguitySearch.expansions))
+      self.accepts_empty = () in ambiguitySearch.expansions
+      if self.accepts_empty:
+        raise GrammarError('Empty string should not be accepted.')
+
+      self.ambiguities = ambiguitySearch.search(limit)
+      if self.ambiguities:
+        raise GrammarError('Ambiguities')
+
+    except GrammarError as err:
+      self.error = err.message
+
+# Analyses are keyed by token sequence, so grammars differing only in
+# whitespace share an entry. As with EXPANSION_CACHE, the instance's cache
+# is bounded by the total number of expansions held.
+ANALYSIS_CACHE_SIZE = 200000
+ANALYSIS_CACHE = TieredCache(ANALYSIS_CACHE_SIZE, memcache, 'shorthand-analysis:', lambda analysis: len(analysis.expansions) + 1)
+
+def analyse(tokens, engine='concrete', limit=None):
+  key = (tuple(tokens), engine, limit)
+  analysis = ANALYSIS_CACHE.get(key)
+  if analysis is None:
+    analysis = Analysis(tokens, engine, limit)
+    ANALYSIS_CACHE[key] = analysis
+  return analysis
+
+JINJA_ENVIRONMENT = AUTOESCAPE_ENVIRONMENT
 
 
 
@@ -390,6 +663,14 @@ class MainPage(RequestHandler):
         shorthand_template = JINJA_ENVIRONMENT.get_template('templates/shorthand.html')
 
         response = ''
+        try:
+          limit = int(self.request.get('limit'))
+        except ValueError:
+          limit = None
+        if limit is not None and limit < 1:
+          # Stopping before the first ambiguity would hide it.
+          limit = None
+
         try:
           offset_value = self.request.get('offset_value', '')
           tokens = tokenise(offset_value)
@@ -399,30 +680,27 @@ class MainPage(RequestHandler):
           error = 'Unexpected token'
 
         if offset_value != '':
-          try:
-            root = parse(tokens)
-            ambiguitySearch = AmbiguitySearch(root)
-            response = '<br />'.join(map(escape, sorted(map(lambda expansion: ' '.join(expansion), ambiguitySearch.expansions))))
-            if [] in ambiguitySearch.expansions:
-              raise GrammarError('Empty string should not be accepted.')
-
-            ambiguities = ambiguitySearch.search()
-            if ambiguities:
-              response = '<br />'.join(sorted(ambiguities))
-              raise GrammarError('Ambiguities')
+          engine = self.request.get('engine')
+          if engine not in SEARCH_ENGINES:
+            engine = 'concrete'
 
-          except GrammarError as err:
-            error = err.message
+          analysis = analyse(tokens, engine, limit)
+          error = analysis.error
+          if analysis.ambiguities:
+            response = '<br />'.join(analysis.ambiguities)
+          else:
+            response = '<br />'.join(map(escape, analysis.expansions))
 
         shorthand_template_values = {
             'offset_value': offset_value,
             'error': error,
             'response': response
         }
-        self.response.write(shorthand_template.render(shorthand_template_values))
+        with timer('render'):
+          self.response.write(shorthand_template.render(shorthand_template_values))
 
 
 
-app = WSGIApplication([
+app = instrument(WSGIApplication([
     ('/ray/shorthand/', MainPage),
-])
+]))
@@ -0,0 +1,403 @@
+#!/usr/bin/env python
+
+# Geometry of SVG path data, for placing elements along path() offset paths
+# on the server. Paths are parsed into line, cubic Bezier and elliptical arc
+# segments, and a table of cumulative lengths along each segment lets a
+# point and tangent at any distance be found by binary search, then by
+# solving for the curve parameter between samples.
+
+from bisect import bisect_right
+from cache import LRUCache
+from math import atan2, ceil, cos, fabs, isinf, isnan, pi, radians, sin, sqrt
+from re import compile
+
+# Samples per curved segment in the table of lengths. The length of a curve
+# between samples is found by Gauss-Legendre quadrature, using these nodes on
+# [0, 1] and their weights.
+CURVE_SAMPLES = 16
+QUADRATURE = [
+    (0.5 - 0.4530899229693320, 0.1184634425280945),
+    (0.5 - 0.2692346550528416, 0.2393143352496832),
+    (0.5, 0.2844444444444444),
+    (0.5 + 0.2692346550528416, 0.2393143352496832),
+    (0.5 + 0.4530899229693320, 0.1184634425280945),
+]
+
+COMMAND_PATTERN = compile(r'\s*,?\s*([MmZzLlHhVvCcSsQqTtAa])')
+NUMBER_PATTERN = compile(r'\s*,?\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)')
+FLAG_PATTERN = compile(r'\s*,?\s*([01])')
+
+# The number of arguments taken by each command.
+ARGUMENT_COUNTS = {
+    'M': 2, 'L': 2, 'H': 1, 'V': 1, 'C': 6, 'S': 4, 'Q': 4, 'T': 2, 'A': 7, 'Z': 0,
+}
+
+# Intervals are halved until their halves agree with them to within the
+# larger of QUADRATURE_TOLERANCE pixels and QUADRATURE_RELATIVE_TOLERANCE of
+# their length, or QUADRATURE_DEPTH halvings. Each level of QUADRATURE is
+# accurate to about a thousandth of the difference between levels.
+QUADRATURE_TOLERANCE = 1e-9
+QUADRATURE_RELATIVE_TOLERANCE = 1e-12
+QUADRATURE_DEPTH = 30
+
+def gauss_length(segment, t0, t1):
+    length = 0.
+    for (node, weight) in QUADRATURE:
+        (dx, dy) = segment.derivative(t0 + node * (t1 - t0))
+        length += weight * sqrt(dx * dx + dy * dy)
+    return length * (t1 - t0)
+
+def adaptive_length(segment, t0, t1, length, depth):
+    middle = (t0 + t1) / 2
+    first = gauss_length(segment, t0, middle)
+    second = gauss_length(segment, middle, t1)
+    tolerance = max(QUADRATURE_TOLERANCE, QUADRATURE_RELATIVE_TOLERANCE * fabs(length))
+    # Written so that a NaN difference also stops.
+    if depth == 0 or not fabs(first + second - length) > tolerance:
+        return first + second
+    return adaptive_length(segment, t0, middle, first, depth - 1) + adaptive_length(segment, middle, t1, second, depth - 1)
+
+# The length of segment between parameters t0 and t1. Sharp turns need many
+# more intervals than the rest of a curve, so they are found adaptively.
+def quadrature_length(segment, t0, t1):
+    return adaptive_length(segment, t0, t1, gauss_length(segment, t0, t1), QUADRATURE_DEPTH)
+
+
+class Line(object):
+    __slots__ = ('x0', 'y0', 'x1', 'y1')
+    def __init__(self, x0, y0, x1, y1):
+        self.x0 = x0
+        self.y0 = y0
+        self.x1 = x1
+        self.y1 = y1
+    def point(self, t):
+        return (self.x0 + t * (self.x1 - self.x0), self.y0 + t * (self.y1 - self.y0))
+    def derivative(self, t):
+        return (self.x1 - self.x0, self.y1 - self.y0)
+    def samples(self):
+        return 1
+    def length(self, t0, t1):
+        return sqrt((self.x1 - self.x0) * (self.x1 - self.x0) + (self.y1 - self.y0) * (self.y1 - self.y0)) * (t1 - t0)
+
+class Cubic(object):
+    __slots__ = ('x0', 'y0', 'x1', 'y1', 'x2', 'y2', 'x3', 'y3')
+    def __init__(self, x0, y0, x1, y1, x2, y2, x3, y3):
+        self.x0 = x0
+        self.y0 = y0
+        self.x1 = x1
+        self.y1 = y1
+        self.x2 = x2
+        self.y2 = y2
+        self.x3 = x3
+        self.y3 = y3
+    def point(self, t):
+        s = 1 - t
+        a = s * s * s
+        b = 3 * s * s * t
+        c = 3 * s * t * t
+        d = t * t * t
+        return (a * self.x0 + b * self.x1 + c * self.x2 + d * self.x3,
+                a * self.y0 + b * self.y1 + c * self.y2 + d * self.y3)
+    def derivative(self, t):
+        s = 1 - t
+        a = 3 * s * s
+        b = 6 * s * t
+        c = 3 * t * t
+        return (a * (self.x1 - self.x0) + b * (self.x2 - self.x1) + c * (self.x3 - self.x2),
+                a * (self.y1 - self.y0) + b * (self.y2 - self.y1) + c * (self.y3 - self.y2))
+    def samples(self):
+        return CURVE_SAMPLES
+    def length(self, t0, t1):
+        return quadrature_length(self, t0, t1)
+
+# An elliptical arc with centre (cx, cy) and radii rx and ry, rotated by phi
+# radians, from angle theta to angle theta + delta.
+class Arc(object):
+    __slots__ = ('cx', 'cy', 'rx', 'ry', 'phi', 'theta', 'delta')
+    def __init__(self, cx, cy, rx, ry, phi, theta, delta):
+        self.cx = cx
+        self.cy = cy
+        self.rx = rx
+        self.ry = ry
+        self.phi = phi
+        self.theta = theta
+        self.delta = delta
+    def point(self, t):
+        angle = self.theta + t * self.delta
+        x = self.rx * cos(angle)
+        y = self.ry * sin(angle)
+        return (self.cx + cos(self.phi) * x - sin(self.phi) * y,
+                self.cy + sin(self.phi) * x + cos(self.phi) * y)
+    def derivative(self, t):
+        angle = self.theta + t * self.delta
+        x = -self.rx * sin(angle) * self.delta
+        y = self.ry * cos(angle) * self.delta
+        return (cos(self.phi) * x - sin(self.phi) * y,
+                sin(self.phi) * x + cos(self.phi) * y)
+    def samples(self):
+        return int(ceil(CURVE_SAMPLES * fabs(self.delta) / (2 * pi))) or 1
+    def length(self, t0, t1):
+        return quadrature_length(self, t0, t1)
+
+def quadratic(x0, y0, x1, y1, x2, y2):
+    # Degree elevation gives the same curve exactly.
+    return Cubic(x0, y0,
+                 x0 + 2. / 3 * (x1 - x0), y0 + 2. / 3 * (y1 - y0),
+                 x2 + 2. / 3 * (x1 - x2), y2 + 2. / 3 * (y1 - y2),
+                 x2, y2)
+
+def finite(*values):
+    return not any(isinf(value) or isnan(value) for value in values)
+
+def angle_between(ux, uy, vx, vy):
+    return atan2(ux * vy - uy * vx, ux * vx + uy * vy)
+
+# Converts an arc from endpoint to centre parameterization, following
+# https://www.w3.org/TR/SVG/implnote.html#ArcConversionEndpointToCenter
+def arc(x0, y0, rx, ry, rotation, large_arc, sweep, x1, y1):
+    if x0 == x1 and y0 == y1:
+        return None
+    rx = fabs(rx)
+    ry = fabs(ry)
+    if rx * rx == 0 or ry * ry == 0:
+        # Radii so small that their squares underflow are treated as zero.
+        return Line(x0, y0, x1, y1)
+
+    phi = radians(rotation % 360)
+    dx = (x0 - x1) / 2.
+    dy = (y0 - y1) / 2.
+    x = cos(phi) * dx + sin(phi) * dy
+    y = -sin(phi) * dx + cos(phi) * dy
+
+    # Scale up radii too small to reach the end point.
+    scale = (x * x) / (rx * rx) + (y * y) / (ry * ry)
+    if scale > 1:
+        rx *= sqrt(scale)
+        ry *= sqrt(scale)
+
+    numerator = rx * rx * ry * ry - rx * rx * y * y - ry * ry * x * x
+    denominator = rx * rx * y * y + ry * ry * x * x
+    if denominator == 0:
+        # The end points are too close for the arc between them to be found.
+        return Line(x0, y0, x1, y1)
+    factor = sqrt(max(0, numerator / denominator))
+    if large_arc == sweep:
+        factor = -factor
+    cx = factor * rx * y / ry
+    cy = -factor * ry * x / rx
+
+    theta = angle_between(1, 0, (x - cx) / rx, (y - cy) / ry)
+    delta = angle_between((x - cx) / rx, (y - cy) / ry, (-x - cx) / rx, (-y - cy) / ry)
+    if not sweep and delta > 0:
+        delta -= 2 * pi
+    elif sweep and delta < 0:
+        delta += 2 * pi
+
+    (cx, cy) = (cos(phi) * cx - sin(phi) * cy + (x0 + x1) / 2.,
+                sin(phi) * cx + cos(phi) * cy + (y0 + y1) / 2.)
+    if not finite(cx, cy, rx, ry, theta, delta):
+        # Coordinates so large that the conversion overflows.
+        return Line(x0, y0, x1, y1)
+    return Arc(cx, cy, rx, ry, phi, theta, delta)
+
+# Parses path data into a list of segments, in absolute coordinates. As when
+# rendering, the path is used up to the first error in its data.
+def parse_path(data):
+    segments = []
+    position = 0
+    command = None
+    x = y = 0.
+    start_x = start_y = 0.
+    # The previous control point, for reflection by S and T.
+    control = None
+
+    while True:
+        match = COMMAND_PATTERN.match(data, position)
+        if match is not None:
+            if command is None and match.group(1) not in 'Mm':
+                # Path data must begin with a moveto.
+                break
+            command = match.group(1)
+            position = match.end()
+        elif command is None or command in 'Zz' or data[position:].strip(' \t\r\n,') == '':
+            break
+        # Otherwise, the previous command is repeated with further arguments.
+
+        upper = command.upper()
+        arguments = []
+        for index in range(ARGUMENT_COUNTS[upper]):
+            pattern = FLAG_PATTERN if upper == 'A' and index in (3, 4) else NUMBER_PATTERN
+            argument = pattern.match(data, position)
+            if argument is None:
+                break
+            arguments.append(float(argument.group(1)))
+            position = argument.end()
+        if len(arguments) < ARGUMENT_COUNTS[upper]:
+            break
+
+        relative = command != upper
+        if relative and upper != 'Z':
+            for index in range(len(arguments)):
+                if upper == 'H':
+                    arguments[index] += x
+                elif upper == 'V':
+                    arguments[index] += y
+                elif upper == 'A':
+                    if index == 5:
+                        arguments[index] += x
+                    elif index == 6:
+                        arguments[index] += y
+                else:
+                    arguments[index] += y if index % 2 else x
+        if not finite(*arguments):
+            # Numbers out of range are errors in the data too.
+            break
+
+        previous_control = control
+        control = None
+        if upper == 'M':
+            x, y = arguments
+            start_x, start_y = x, y
+            # Further coordinate pairs are treated as line commands.
+            command = 'l' if relative else 'L'
+        elif upper == 'Z':
+            if (x, y) != (start_x, start_y):
+                segments.append(Line(x, y, start_x, start_y))
+            x, y = start_x, start_y
+        elif upper in 'LHV':
+            if upper == 'L':
+                (x1, y1) = arguments
+            elif upper == 'H':
+                (x1, y1) = (arguments[0], y)
+            else:
+                (x1, y1) = (x, arguments[0])
+            segments.append(Line(x, y, x1, y1))
+            x, y = x1, y1
+        elif upper in 'CS':
+            if upper == 'C':
+                (x1, y1, x2, y2, x3, y3) = arguments
+            else:
+                (x2, y2, x3, y3) = arguments
+                if previous_control is not None and previous_control[0] == 'C':
+                    (x1, y1) = (2 * x - previous_control[1], 2 * y - previous_control[2])
+                else:
+                    (x1, y1) = (x, y)
+            segments.append(Cubic(x, y, x1, y1, x2, y2, x3, y3))
+            control = ('C', x2, y2)
+            x, y = x3, y3
+        elif upper in 'QT':
+            if upper == 'Q':
+                (x1, y1, x2, y2) = arguments
+            else:
+                (x2, y2) = arguments
+                if previous_control is not None and previous_control[0] == 'Q':
+                    (x1, y1) = (2 * x - previous_control[1], 2 * y - previous_control[2])
+                else:
+                    (x1, y1) = (x, y)
+            segments.append(quadratic(x, y, x1, y1, x2, y2))
+            control = ('Q', x1, y1)
+            x, y = x2, y2
+        else:
+            (rx, ry, rotation, large_arc, sweep, x1, y1) = arguments
+            segment = arc(x, y, rx, ry, rotation, large_arc, sweep, x1, y1)
+            if segment is not None:
+                segments.append(segment)
+            x, y = x1, y1
+
+    if not segments and command is not None:
+        # A lone moveto still gives a position.
+        segments.append(Line(start_x, start_y, start_x, start_y))
+    return segments
+
+
+# The parameter between t0 and t1 at which the length of segment from t0 is
+# length, starting from the estimate t. Newton's method converges in a few
+# steps, as the speed along a curve varies little between samples; a step
+# leaving the bracket of t bisects it instead.
+PARAMETER_TOLERANCE = 1e-9
+PARAMETER_ITERATIONS = 20
+
+def parameter_at_length(segment, t0, t1, length, t):
+    lower, upper = t0, t1
+    for iteration in range(PARAMETER_ITERATIONS):
+        error = segment.length(t0, t) - length
+        if fabs(error) <= PARAMETER_TOLERANCE:
+            break
+        if error > 0:
+            upper = t
+        else:
+            lower = t
+        (dx, dy) = segment.derivative(t)
+        speed = sqrt(dx * dx + dy * dy)
+        step = t - error / speed if speed > 0 else lower
+        t = step if lower < step < upper else (lower + upper) / 2
+    return t
+
+
+# The parsed segments of a path, with the cumulative length of the path at
+# each sample point along them.
+class PathGeometry(object):
+    def __init__(self, data):
+        self.segments = parse_path(data)
+        self.closed = data.strip().endswith(('z', 'Z'))
+
+        # Sample k lies at parameter samples[k][1] along segment samples[k][0].
+        self.lengths = [0.]
+        self.samples = [(0, 0.)]
+        length = 0.
+        for index, segment in enumerate(self.segments):
+            count = segment.samples()
+            lengths = []
+            for sample in range(count):
+                length += segment.length(float(sample) / count, float(sample + 1) / count)
+                lengths.append(length)
+            if not finite(length):
+                # The path is used up to the segment whose length overflows.
+                del self.segments[index:]
+                self.closed = False
+                break
+            self.lengths.extend(lengths)
+            self.samples.extend((index, float(sample + 1) / count) for sample in range(count))
+        self.length = self.lengths[-1]
+
+    # Returns (x, y, dx, dy): the point at distance along the path, and the
+    # direction of the path there.
+    def point_at_length(self, distance):
+        if not self.segments:
+            return (0., 0., 0., 0.)
+
+        # The samples either side of distance.
+        k = min(max(bisect_right(self.lengths, distance) - 1, 0), len(self.lengths) - 2)
+        (index, t1) = self.samples[k + 1]
+        (previous_index, t0) = self.samples[k]
+        if previous_index != index:
+            t0 = 0.
+
+        segment = self.segments[index]
+        span = self.lengths[k + 1] - self.lengths[k]
+        if span > 0:
+            length = min(max(distance - self.lengths[k], 0.), span)
+            t = parameter_at_length(segment, t0, t1, length, t0 + length / span * (t1 - t0))
+        else:
+            t = t0
+
+        (x, y) = segment.point(t)
+        (dx, dy) = segment.derivative(t)
+        if dx == 0 and dy == 0:
+            # The curve has a cusp here, so follow the chord instead.
+            (x0, y0) = segment.point(t0)
+            (x1, y1) = segment.point(t1)
+            (dx, dy) = (x1 - x0, y1 - y0)
+        return (x, y, dx, dy)
+
+PATH_GEOMETRY_CACHE_SIZE = 64
+PATH_GEOMETRY_CACHE = LRUCache(PATH_GEOMETRY_CACHE_SIZE)
+
+# Parsing and measuring a path is done once for all the elements placed
+# along it.
+def path_geometry(data):
+    geometry = PATH_GEOMETRY_CACHE.get(data)
+    if geometry is None:
+        geometry = PathGeometry(data)
+        PATH_GEOMETRY_CACHE[data] = geometry
+    return geometry
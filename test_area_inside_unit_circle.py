@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+# Checks the triangle/unit-circle areas against closed-form cases and a
+# grid estimate, and checks that the batch form matches the scalar form bit
+# for bit, across randomized triangles:
+#
+#     python -m unittest discover
+
+from math import acos, cos, fabs, pi, sin, sqrt
+from random import Random
+from unittest import main, skipIf, TestCase
+
+from ray import area_inside_unit_circle, Point
+
+try:
+    import numpy as np
+    from ray_batch import areas_inside_unit_circle
+except ImportError:
+    np = None
+
+SEED = 4
+TRIANGLES = 50000
+SCALES = [0.5, 1, 2, 4]
+
+# Grid points per unit of length, and the largest difference that allows
+# between the estimate and the area.
+GRID_RESOLUTION = 400
+GRID_TOLERANCE = 0.002
+GRID_TRIANGLES = 50
+
+
+def random_triangles(random, count):
+    for index in range(count):
+        scale = random.choice(SCALES)
+        yield [Point(random.uniform(-scale, scale), random.uniform(-scale, scale)) for vertex in range(3)]
+
+
+def area(triangle):
+    return area_inside_unit_circle(*triangle)
+
+
+def triangle_area(p1, p2, p3):
+    return fabs((p2.x - p1.x) * (p3.y - p1.y) - (p2.y - p1.y) * (p3.x - p1.x)) / 2
+
+
+# Estimates the area from the fraction of grid points in the unit circle
+# that are inside the triangle.
+def grid_area(triangle):
+    coordinates = (np.arange(2 * GRID_RESOLUTION) + 0.5) / GRID_RESOLUTION - 1
+    (x, y) = np.meshgrid(coordinates, coordinates)
+    in_circle = x * x + y * y <= 1
+    sides = [(b.x - a.x) * (y - a.y) - (b.y - a.y) * (x - a.x)
+             for (a, b) in zip(triangle, triangle[1:] + triangle[:1])]
+    in_triangle = (((sides[0] >= 0) & (sides[1] >= 0) & (sides[2] >= 0))
+                   | ((sides[0] <= 0) & (sides[1] <= 0) & (sides[2] <= 0)))
+    return np.count_nonzero(in_circle & in_triangle) / float(GRID_RESOLUTION * GRID_RESOLUTION)
+
+
+class AreaInsideUnitCircleTest(TestCase):
+    def test_triangles_inside(self):
+        for triangle in random_triangles(Random(SEED), 1000):
+            triangle = [Point(vertex.x / 8, vertex.y / 8) for vertex in triangle]
+            self.assertAlmostEqual(area(triangle), triangle_area(*triangle), 12)
+
+    def test_triangles_enclosing(self):
+        self.assertAlmostEqual(area([Point(-3, -3), Point(3, -3), Point(0, 5)]), pi, 12)
+        self.assertAlmostEqual(area([Point(0, 5), Point(3, -3), Point(-3, -3)]), pi, 12)
+
+    def test_sectors(self):
+        for degrees in [1, 30, 90, 135, 179]:
+            angle = degrees * pi / 180
+            # The far edge stays outside the circle, leaving a sector.
+            triangle = [Point(0, 0), Point(1000, 0), Point(1000 * cos(angle), 1000 * sin(angle))]
+            self.assertAlmostEqual(area(triangle), angle / 2, 12)
+
+    def test_segments(self):
+        for height in [-0.9, -0.5, 0, 0.5, 0.9]:
+            # A triangle covering the circle above y = height.
+            triangle = [Point(-1000, height), Point(1000, height), Point(0, 1000)]
+            self.assertAlmostEqual(area(triangle), acos(height) - height * sqrt(1 - height * height), 12)
+
+    def test_degenerate(self):
+        self.assertEqual(area([Point(0, 0), Point(0, 0), Point(0, 0)]), 0)
+        self.assertEqual(area([Point(0.5, 0), Point(2, 0), Point(0.5, 0)]), 0)
+
+    @skipIf(np is None, 'grid estimate requires numpy')
+    def test_matches_grid(self):
+        for triangle in random_triangles(Random(SEED), GRID_TRIANGLES):
+            self.assertLessEqual(fabs(area(triangle) - grid_area(triangle)), GRID_TOLERANCE)
+
+    @skipIf(np is None, 'ray_batch requires numpy')
+    def test_batch_matches_scalar(self):
+        triangles = list(random_triangles(Random(SEED), TRIANGLES))
+        vertices = np.array([[[vertex.x, vertex.y] for vertex in triangle] for triangle in triangles])
+        areas = areas_inside_unit_circle(vertices[:, 0], vertices[:, 1], vertices[:, 2])
+        self.assertEqual(areas.tolist(), map(area, triangles))
+
+
+if __name__ == '__main__':
+    main()
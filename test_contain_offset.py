@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+# Checks the contain solvers against the all-pairs solver they replaced,
+# across randomized placements:
+#
+#     python -m unittest discover
+
+from math import fabs, sqrt
+from random import Random
+from unittest import main, skipIf, TestCase
+
+from ray import (contain_offset, Element, greatest_lower_bound, Interval,
+                 least_upper_bound, OffsetRotation, Point, RayPath, rotate, Size)
+
+try:
+    import numpy as np
+    from ray_batch import contain_offsets
+except ImportError:
+    np = None
+
+SEED = 1
+PLACEMENTS = 20000
+
+# Results only differ where several pairs of vertices give the same path
+# length, in rounding.
+TOLERANCE = 1e-9
+
+
+# The solver formerly in Element.compute_offset, which considers every pair
+# of vertices in order of distance from the ray.
+def reference_contain_offset(vertices, angle, radius, computed_offset):
+    epsilon = 0.0001
+    vertices = map(rotate(90 - angle), vertices)
+    vertices.sort(key=lambda p: -fabs(p.y))
+
+    intervals = []
+    for v in vertices:
+        discriminant = radius * radius - v.y * v.y
+        if discriminant < 0:
+            break
+        intervals.append(Interval(-v.x - sqrt(discriminant), -v.x + sqrt(discriminant)))
+
+    if len(intervals) == len(vertices):
+        lower_bound = greatest_lower_bound(intervals)
+        upper_bound = least_upper_bound(intervals)
+        if lower_bound <= upper_bound:
+            return max(lower_bound, min(upper_bound, computed_offset))
+
+    radius = fabs(vertices[0].y)
+    offset = -vertices[0].x
+
+    for i in range(3):
+        for j in range(i+1, 4):
+            xi = vertices[i].x
+            yi = vertices[i].y
+            xj = vertices[j].x
+            yj = vertices[j].y
+            xd = xi - xj
+
+            if xd * xd + yj * yj <= yi * yi + epsilon:
+                continue
+
+            candidate_offset = (xj * xj + yj * yj - xi * xi - yi * yi) / 2 / xd
+            xi += candidate_offset
+            candidate_radius = sqrt(xi * xi + yi * yi)
+            if radius < candidate_radius:
+                radius = candidate_radius
+                offset = candidate_offset
+
+    return offset
+
+
+# Yields (vertices, angle, radius, computed_offset) for random rectangles
+# placed along ray() paths, over a third of which do not fit their path.
+def random_placements(random, count):
+    for index in range(count):
+        size = Size(random.uniform(0, 200), random.uniform(0, 200))
+        angle = random.uniform(-360, 360)
+        element = Element(
+            id = 'box',
+            size = size,
+            background_color = '',
+            offset_path = RayPath(angle, 'closest-side', True),
+            offset_distance = 0,
+            offset_rotation = OffsetRotation(random.random() < 0.5, random.uniform(-180, 180)),
+            offset_position = Point(250, 250),
+            offset_anchor = Point(random.uniform(0, size.width), random.uniform(0, size.height)),
+            container_size = Size(500, 500)
+        )
+        radius = random.uniform(0, 250)
+        yield (element.v, angle, radius, random.uniform(0, radius))
+
+
+def batch_contain_offsets(placements):
+    return contain_offsets(
+        np.array([[[vertex.x, vertex.y] for vertex in vertices] for (vertices, _, _, _) in placements]),
+        np.array([angle for (_, angle, _, _) in placements]),
+        np.array([radius for (_, _, radius, _) in placements]),
+        np.array([computed_offset for (_, _, _, computed_offset) in placements]))
+
+
+class ContainOffsetTest(TestCase):
+    def assertClose(self, actual, expected, radius):
+        self.assertLessEqual(fabs(actual - expected), TOLERANCE * max(1, radius, fabs(expected)))
+
+    def test_matches_reference(self):
+        for (vertices, angle, radius, computed_offset) in random_placements(Random(SEED), PLACEMENTS):
+            self.assertClose(
+                contain_offset(vertices, angle, radius, computed_offset),
+                reference_contain_offset(vertices, angle, radius, computed_offset),
+                radius)
+
+    @skipIf(np is None, 'ray_batch requires numpy')
+    def test_batch_matches_reference(self):
+        placements = list(random_placements(Random(SEED), PLACEMENTS))
+        for offset, (vertices, angle, radius, computed_offset) in zip(batch_contain_offsets(placements), placements):
+            self.assertClose(offset, reference_contain_offset(vertices, angle, radius, computed_offset), radius)
+
+    @skipIf(np is None, 'ray_batch requires numpy')
+    def test_batch_matches_scalar(self):
+        placements = list(random_placements(Random(SEED), PLACEMENTS))
+        for offset, (vertices, angle, radius, computed_offset) in zip(batch_contain_offsets(placements), placements):
+            self.assertEqual(offset, contain_offset(vertices, angle, radius, computed_offset))
+
+
+if __name__ == '__main__':
+    main()
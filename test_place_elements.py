@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+# Checks that ray_batch.place_elements gives exactly the vertices, path
+# lengths, computed offsets and translations of Element, across randomized
+# ray() placements:
+#
+#     python -m unittest discover
+
+from random import Random
+from unittest import main, skipIf, TestCase
+
+from ray import Element, OffsetRotation, Point, RayPath, Size
+
+try:
+    import numpy as np
+    from ray_batch import place_elements, RAY_SIZES
+except ImportError:
+    np = None
+    RAY_SIZES = []
+
+SEED = 1
+PLACEMENTS = 20000
+CONTAINER_SIZE = Size(500, 500)
+
+
+# Returns the keyword arguments of place_elements for count random ray()
+# placements, with every ray size, an unknown size, and contain both on and
+# off.
+def random_arguments(random, count):
+    arguments = dict(sizes=[], anchors=[], positions=[], angles=[], distances=[],
+                     ray_sizes=[], contain=[], rotation_auto=[], rotation_angles=[])
+    for index in range(count):
+        arguments['sizes'].append((random.uniform(0, 200), random.uniform(0, 200)))
+        arguments['anchors'].append((random.uniform(-50, 250), random.uniform(-50, 250)))
+        arguments['positions'].append((random.uniform(-100, 600), random.uniform(-100, 600)))
+        arguments['angles'].append(random.choice([0, 45, 90, random.uniform(-360, 360)]))
+        arguments['distances'].append(random.uniform(-50, 150))
+        arguments['ray_sizes'].append(random.choice(RAY_SIZES + ['bogus']))
+        arguments['contain'].append(random.random() < 0.5)
+        arguments['rotation_auto'].append(random.random() < 0.5)
+        arguments['rotation_angles'].append(random.uniform(-180, 180))
+    return arguments
+
+
+def element(arguments, index):
+    (width, height) = arguments['sizes'][index]
+    (anchor_x, anchor_y) = arguments['anchors'][index]
+    (position_x, position_y) = arguments['positions'][index]
+    return Element(
+        id = 'box',
+        size = Size(width, height),
+        background_color = '',
+        offset_path = RayPath(arguments['angles'][index], arguments['ray_sizes'][index], arguments['contain'][index]),
+        offset_distance = arguments['distances'][index],
+        offset_rotation = OffsetRotation(arguments['rotation_auto'][index], arguments['rotation_angles'][index]),
+        offset_position = Point(position_x, position_y),
+        offset_anchor = Point(anchor_x, anchor_y),
+        container_size = CONTAINER_SIZE
+    )
+
+
+@skipIf(np is None, 'ray_batch requires numpy')
+class PlaceElementsTest(TestCase):
+    def test_matches_element(self):
+        arguments = random_arguments(Random(SEED), PLACEMENTS)
+        batch = place_elements(container_sizes=(CONTAINER_SIZE.width, CONTAINER_SIZE.height), **arguments)
+        self.assertEqual(len(batch), PLACEMENTS)
+        for index in range(PLACEMENTS):
+            expected = element(arguments, index)
+            self.assertEqual(batch.path_length[index], expected.path_length)
+            self.assertEqual(batch.computed_offset[index], expected.computed_offset)
+            self.assertEqual(list(batch.translation[index]), [expected.translation.x, expected.translation.y])
+            self.assertEqual(batch.v[index].tolist(), [[vertex.x, vertex.y] for vertex in expected.v])
+
+    def test_broadcasts_shared_arguments(self):
+        arguments = random_arguments(Random(SEED), 100)
+        arguments['sizes'] = [(100, 50)] * 100
+        arguments['contain'] = [True] * 100
+        shared = dict(arguments, sizes=(100, 50), contain=True)
+        expected = place_elements(**arguments)
+        actual = place_elements(**shared)
+        self.assertEqual(actual.v.tolist(), expected.v.tolist())
+        self.assertEqual(actual.computed_offset.tolist(), expected.computed_offset.tolist())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Checks that submission measurements survive packing, across randomized
+# results. Requires the App Engine SDK on the path:
+#
+#     python -m unittest discover
+
+from random import Random
+from unittest import main, skipIf, TestCase
+
+try:
+    from position import (create_submission, pack_measurements, RESULT_INDEX_LIMIT,
+                          result_name, unpack_measurements)
+except ImportError:
+    pack_measurements = None
+
+SEED = 11
+SUBMISSIONS = 2000
+
+# The characters VALUE_REGEX accepts.
+VALUE_CHARACTERS = ' %()+-.0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def random_serialization(random):
+    return ''.join(random.choice(VALUE_CHARACTERS) for index in range(random.randint(1, 40)))
+
+
+# Returns a dict from result name to serialization, with indices up to the
+# largest that packs, and many results sharing each serialization.
+def random_results(random, count):
+    serializations = [random_serialization(random) for index in range(random.randint(1, 20))]
+    results = {}
+    for index in range(count):
+        context = random.choice([random.randint(0, 100), random.randint(0, RESULT_INDEX_LIMIT - 1)])
+        value = random.choice([random.randint(0, 100), RESULT_INDEX_LIMIT - 1])
+        results[result_name(context, value)] = random.choice(serializations)
+    return results
+
+
+@skipIf(pack_measurements is None, 'position requires the App Engine SDK')
+class PackMeasurementsTest(TestCase):
+    def test_round_trip(self):
+        random = Random(SEED)
+        for index in range(SUBMISSIONS):
+            results = random_results(random, random.randint(0, 200))
+            self.assertEqual(unpack_measurements(pack_measurements(results)), results)
+
+    def test_round_trip_non_ascii(self):
+        results = {
+            'result_0_0': u'translate(1px, 2px) é',
+            'result_0_1': u'☃',
+            'result_1_0': u'',
+        }
+        self.assertEqual(unpack_measurements(pack_measurements(results)), results)
+
+    def test_shares_serializations(self):
+        results = dict((result_name(context, 0), 'none') for context in range(100))
+        self.assertEqual(len(pack_measurements(results)), 4 + 4 + len('none') + 100 * 12)
+
+    def test_create_submission_round_trip(self):
+        random = Random(SEED)
+        results = random_results(random, 200)
+        fields = dict(results, browser='Chrome', version='60')
+        (submission, error) = create_submission('Chrome', '60', fields)
+        self.assertEqual(error, '')
+        self.assertEqual(submission.results(), results)
+
+    def test_create_submission_rejects_large_indices(self):
+        for name in [result_name(RESULT_INDEX_LIMIT, 0), result_name(0, RESULT_INDEX_LIMIT)]:
+            self.assertEqual(create_submission('Chrome', '60', {name: 'none'}), (None, 'Bad <position> result'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Checks the shorthand tokenizer and parser against the token-by-token
+# tokenizer and list-slicing parser they replaced, across randomized
+# grammars:
+#
+#     python -m unittest discover
+
+from random import Random
+from unittest import main, TestCase
+
+from shorthand import (Atom, ATOMS, Bracketed, DoubleAmperstand, DoubleBar, Exclamation,
+                       GrammarError, Juxtaposition, parse, Question, SingleBar, tokenise, TOKENS)
+
+SEED = 7
+GRAMMARS = 20000
+
+# Tokens, whitespace and text that is not a token, so that about a quarter of
+# the grammars parse and the rest fail to tokenize or parse.
+PIECES = TOKENS + [' ', '  ', '\t', u'　', 'x', '<', '|', '[', ']']
+
+
+# The tokenizer formerly in tokenise, which compares each token in turn.
+def reference_tokenise(grammar):
+    result = []
+    position = 0
+    while position < len(grammar):
+        if grammar[position].isspace():
+            position += 1
+            continue
+
+        for token in TOKENS:
+            if grammar[position:position+len(token)] == token:
+                result.append(token)
+                position += len(token)
+                break
+        else:
+            raise GrammarError('Unknown token at "{}"'.format(grammar[position:]))
+    return result
+
+
+# The parser formerly in parse, which passes on a slice of the remaining
+# tokens at each step.
+def reference_parse(tokens):
+    remaining = list(tokens)
+    remaining.append(None)
+    (result, remaining) = reference_parse_single_bar(remaining)
+    if remaining != [None]:
+        raise GrammarError('Unexpected input at "{}"'.format(' '.join(remaining[:-1])))
+    return result
+
+def reference_parse_sequence(remaining, separator, parse_item, node_type):
+    (first, remaining) = parse_item(remaining)
+    result = [first]
+    while remaining[0] == separator:
+        (next, remaining) = parse_item(remaining[1:])
+        result.append(next)
+
+    if len(result) == 1:
+        return (result[0], remaining)
+    return (node_type(result), remaining)
+
+def reference_parse_single_bar(remaining):
+    return reference_parse_sequence(remaining, '|', reference_parse_double_bar, SingleBar)
+
+def reference_parse_double_bar(remaining):
+    return reference_parse_sequence(remaining, '||', reference_parse_double_amperstand, DoubleBar)
+
+def reference_parse_double_amperstand(remaining):
+    return reference_parse_sequence(remaining, '&&', reference_parse_juxtaposition, DoubleAmperstand)
+
+def reference_parse_juxtaposition(remaining):
+    (first, remaining) = reference_parse_single(remaining)
+    result = [first]
+    while remaining[0] not in [']', '&&', '||', '|', None]:
+        (next, remaining) = reference_parse_single(remaining)
+        result.append(next)
+
+    if len(result) == 1:
+        return (result[0], remaining)
+    return (Juxtaposition(result), remaining)
+
+def reference_parse_single(remaining):
+    if remaining[0] == '[':
+        (body, remaining) = reference_parse_single_bar(remaining[1:])
+        if remaining[0] != ']':
+            raise GrammarError('Expected ] at "{}"'.format(' '.join(remaining[:-1])))
+        body = Bracketed(body)
+        remaining = remaining[1:]
+    elif remaining[0] in ATOMS:
+        body = Atom(remaining[0])
+        remaining = remaining[1:]
+        if remaining[0] == '!':
+            raise GrammarError('Unexpected ! after {}'.format(str(body)))
+    elif remaining[0] == None:
+        raise GrammarError('Unexpected end of input')
+    else:
+        raise GrammarError('Unexpected token at "{}"'.format(' '.join(remaining[:-1])))
+
+    if remaining[0] == '!':
+        return (Exclamation(body), remaining[1:])
+
+    if remaining[0] == '?':
+        return (Question(body), remaining[1:])
+
+    return (body, remaining)
+
+
+# The node types of a parse tree, with atoms by value.
+def structure(node):
+    if isinstance(node, Atom):
+        return node.value
+    if isinstance(node, (Bracketed, Exclamation, Question)):
+        return (type(node).__name__, structure(node.body))
+    return (type(node).__name__,) + tuple(map(structure, node.contents))
+
+
+# Returns what tokenizing and then parsing grammar gives: the tokens and
+# parse tree, or the message of the GrammarError raised.
+def outcome(grammar, tokenise, parse):
+    try:
+        tokens = tokenise(grammar)
+    except GrammarError as error:
+        return ('tokenise', error.message)
+    except UnicodeError as error:
+        # Raised by both when the message quotes non-ASCII text.
+        return ('tokenise', type(error).__name__)
+    try:
+        return ('parse', tokens, structure(parse(tokens)))
+    except GrammarError as error:
+        return ('parse', tokens, error.message)
+
+
+def random_grammars(random, count):
+    for index in range(count):
+        yield ''.join(random.choice(PIECES) for piece in range(random.randint(0, 12)))
+
+
+class ShorthandTest(TestCase):
+    def test_matches_reference(self):
+        for grammar in random_grammars(Random(SEED), GRAMMARS):
+            self.assertEqual(outcome(grammar, tokenise, parse),
+                             outcome(grammar, reference_tokenise, reference_parse),
+                             repr(grammar))
+
+    def test_parses_long_grammars(self):
+        grammar = ' '.join(['[ <angle> || <size> ]?'] * 2000)
+        self.assertEqual(structure(parse(tokenise(grammar))),
+                         structure(reference_parse(reference_tokenise(grammar))))
+
+
+if __name__ == '__main__':
+    main()
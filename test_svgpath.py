@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+# Checks path lengths and points against closed forms and fine numeric
+# integration, across randomized curves:
+#
+#     python -m unittest discover
+
+from math import cos, fabs, pi, sin, sqrt
+from random import Random
+from unittest import main, TestCase
+
+from svgpath import Arc, Line, PathGeometry
+
+SEED = 22
+CURVES = 30
+POINTS_PER_CURVE = 10
+
+# The intervals of the Simpson's rule reference, and the largest difference
+# allowed from it, in pixels.
+REFERENCE_INTERVALS = 65536
+TOLERANCE = 1e-6
+
+
+# The parameters at the ends of each pair of intervals.
+REFERENCE_PARAMETERS = [2. * index / REFERENCE_INTERVALS for index in range(REFERENCE_INTERVALS // 2 + 1)]
+
+
+# The length of segment from parameter 0 to each of REFERENCE_PARAMETERS,
+# by composite Simpson's rule.
+def reference_lengths(segment):
+    def speed(t):
+        (dx, dy) = segment.derivative(t)
+        return sqrt(dx * dx + dy * dy)
+
+    h = 1. / REFERENCE_INTERVALS
+    speeds = [speed(index * h) for index in range(REFERENCE_INTERVALS + 1)]
+    lengths = [0.]
+    for index in range(0, REFERENCE_INTERVALS, 2):
+        lengths.append(lengths[-1] + (speeds[index] + 4 * speeds[index + 1] + speeds[index + 2]) * h / 3)
+    return lengths
+
+
+def random_coordinates(random, count):
+    return ' '.join('{:.3f}'.format(random.uniform(0, 500)) for index in range(count))
+
+
+# Yields path data holding a single cubic, quadratic or arc.
+def random_curves(random, count):
+    for index in range(count):
+        kind = random.choice(['C', 'Q', 'A'])
+        if kind == 'C':
+            yield 'M {} C {}'.format(random_coordinates(random, 2), random_coordinates(random, 6))
+        elif kind == 'Q':
+            yield 'M {} Q {}'.format(random_coordinates(random, 2), random_coordinates(random, 4))
+        else:
+            yield 'M {} A {} {} {} {} {} {}'.format(
+                random_coordinates(random, 2),
+                random.uniform(10, 300), random.uniform(10, 300), random.uniform(-180, 180),
+                random.randint(0, 1), random.randint(0, 1), random_coordinates(random, 2))
+
+
+class PathGeometryTest(TestCase):
+    def assertPointClose(self, actual, expected):
+        self.assertLessEqual(sqrt((actual[0] - expected[0]) ** 2 + (actual[1] - expected[1]) ** 2), TOLERANCE)
+
+    def test_lines(self):
+        geometry = PathGeometry('M 10 10 H 40 v 40 L 10 10 z')
+        self.assertEqual(geometry.length, 120)
+        self.assertPointClose(geometry.point_at_length(45)[:2], (40, 25))
+        self.assertPointClose(geometry.point_at_length(95)[:2], (25, 30))
+
+    def test_circle(self):
+        geometry = PathGeometry('M 150 100 A 50 50 0 1 1 50 100 A 50 50 0 1 1 150 100')
+        self.assertLessEqual(fabs(geometry.length - 100 * pi), TOLERANCE)
+        for index in range(37):
+            angle = 2 * pi * index / 36
+            (x, y, dx, dy) = geometry.point_at_length(50 * angle)
+            self.assertPointClose((x, y), (100 + 50 * cos(angle), 100 + 50 * sin(angle)))
+            self.assertAlmostEqual(dx * cos(angle) + dy * sin(angle), 0, 6)
+
+    def test_curves(self):
+        random = Random(SEED)
+        for data in random_curves(random, CURVES):
+            geometry = PathGeometry(data)
+            segment = geometry.segments[0]
+            lengths = reference_lengths(segment)
+            self.assertLessEqual(fabs(geometry.length - lengths[-1]), TOLERANCE, data)
+            for index in random.sample(range(len(lengths)), POINTS_PER_CURVE):
+                self.assertPointClose(geometry.point_at_length(lengths[index])[:2], segment.point(REFERENCE_PARAMETERS[index]))
+
+    def test_relative_commands(self):
+        absolute = PathGeometry('M 10 20 L 30 20 L 30 50 C 40 60 50 60 60 50 C 70 40 80 40 90 50 Q 100 60 110 50 Q 120 40 130 50 A 20 10 30 0 1 160 60 Z')
+        relative = PathGeometry('m 10 20 h 20 v 30 c 10 10 20 10 30 0 s 20 -10 30 0 q 10 10 20 0 t 20 0 a 20 10 30 0 1 30 10 z')
+        self.assertAlmostEqual(relative.length, absolute.length, 9)
+        for index in range(101):
+            distance = absolute.length * index / 100
+            self.assertPointClose(relative.point_at_length(distance)[:2], absolute.point_at_length(distance)[:2])
+
+    def test_stops_at_non_finite_numbers(self):
+        geometry = PathGeometry('M 0 0 L 10 0 L 1e400 0 L 20 0')
+        self.assertEqual(geometry.length, 10)
+        # The length of the second line overflows.
+        geometry = PathGeometry('M 0 0 L 10 0 L 1e200 0 Z')
+        self.assertEqual(len(geometry.segments), 1)
+        self.assertEqual(geometry.length, 10)
+        self.assertFalse(geometry.closed)
+
+    def test_underflowing_arcs_are_lines(self):
+        for data in ['M 0 0 A 1e-200 1e-200 0 0 1 10 0', 'M 0 0 A 0 5 0 0 1 10 0', 'M 0 0 A 1e-170 1e-170 45 0 1 1e-160 1e-160']:
+            geometry = PathGeometry(data)
+            self.assertEqual(len(geometry.segments), 1, data)
+            self.assertIsInstance(geometry.segments[0], Line, data)
+        self.assertIsInstance(PathGeometry('M 0 0 A 5 5 0 0 1 10 0').segments[0], Arc)
+
+
+if __name__ == '__main__':
+    main()